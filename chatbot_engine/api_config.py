@@ -1,8 +1,14 @@
 from fastapi import FastAPI
+from src.exceptions.base import HTTPException
 from src.routes import route_registry
 
 
+def http_exception_handler(request, exc: HTTPException):
+    return exc.to_response(exc.message)
+
+
 def get_api() -> FastAPI:
     app = FastAPI(title="Assistant API")
+    app.add_exception_handler(HTTPException, http_exception_handler)
     route_registry(app)
     return app
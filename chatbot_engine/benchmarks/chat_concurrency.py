@@ -0,0 +1,167 @@
+"""
+Concurrency benchmark for POST /chat on a single worker.
+
+The memory store, retrieval and the LLM chains are replaced with fakes that
+wait a fixed latency, either cooperatively (``asyncio.sleep``, like the
+async clients) or by blocking the event loop (``time.sleep``, like the old
+sync clients).
+Every request finds the same one-exchange history, so it goes through the
+same hops (condense, embedding, search, answer, memory) whatever the
+number of users, and the blocking throughput stays at one request per
+total hop latency while the async one grows with the concurrent users.
+
+Usage (from chatbot_engine/):
+    python -m benchmarks.chat_concurrency --latency 0.05 --requests 64
+"""
+import argparse
+import asyncio
+import os
+import time
+
+for _name in ("OPENAI_API_KEY", "QDRANT_KEY"):
+    os.environ.setdefault(_name, "benchmark")
+os.environ.setdefault("QDRANT_URL", "http://localhost:6333")
+
+from lib.speculative import speculative_search  # noqa: E402
+from src.routes import virtual_assistant  # noqa: E402
+from src.standalone import StandaloneClassifier  # noqa: E402
+from src.turns import ASSISTANT, HUMAN, Turn  # noqa: E402
+
+
+class _Wait:
+    def __init__(self, latency: float, blocking: bool):
+        self.latency = latency
+        self.blocking = blocking
+
+    async def __call__(self):
+        if self.blocking:
+            time.sleep(self.latency)
+        else:
+            await asyncio.sleep(self.latency)
+
+
+HISTORY = [
+    Turn(HUMAN, "What is aws sagemaker?", 0.0),
+    Turn(ASSISTANT, "A managed machine learning service.", 0.0),
+]
+
+
+class FakeMemory:
+    def __init__(self, wait: _Wait):
+        self.wait = wait
+        self.data = {}
+
+    async def load(self, user_id):
+        await self.wait()
+        return HISTORY
+
+    async def append(self, user_id, *entries):
+        await self.wait()
+        self.data[user_id] = list(entries)
+
+
+class FakeChain:
+    def __init__(self, wait: _Wait, output: str):
+        self.wait = wait
+        self.output = output
+
+    async def arun(self, inputs, **kwargs):
+        await self.wait()
+        return self.output
+
+
+class FakeRegistry:
+    def __init__(self, wait: _Wait):
+        self.chains = (
+            FakeChain(wait, "standalone question"),
+            FakeChain(wait, "answer"),
+        )
+        self.selection = None
+
+    def get_chain_from_scratch(self):
+        return self.chains
+
+
+class FakeVectorstore:
+    def __init__(self, wait: _Wait):
+        self.wait = wait
+
+    async def aembed_query(self, query):
+        await self.wait()
+        return [1.0, 0.0]
+
+    async def asimilarity_search(self, query, k=4, selection=None):
+        await self.wait()
+        return []
+
+    async def aspeculative_search(
+        self, question, condense, k=4, selection=None
+    ):
+        new_question, docs, _ = await speculative_search(
+            question, condense, lambda query: self.asimilarity_search(query, k)
+        )
+        return new_question, docs
+
+
+class FakeCache:
+    async def get(self, key):
+        return None
+
+    async def set(self, key, value):
+        pass
+
+
+class FakeSemanticCache:
+    async def lookup(self, embedding):
+        return None
+
+    async def add(self, embedding, answer):
+        pass
+
+
+async def run(concurrency: int, n_requests: int, wait: _Wait) -> float:
+    virtual_assistant.memory_store = FakeMemory(wait)
+    virtual_assistant.registry = FakeRegistry(wait)
+    virtual_assistant.retrieval = FakeVectorstore(wait)
+    virtual_assistant.semantic_cache = FakeSemanticCache()
+    virtual_assistant.standalone = StandaloneClassifier(
+        virtual_assistant.retrieval.aembed_query
+    )
+    virtual_assistant.condensed_questions = FakeCache()
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def user(i: int):
+        async with semaphore:
+            response = await virtual_assistant.ask_question(
+                input="How much does it cost?", user_id=str(i % concurrency)
+            )
+            assert "data" in response, response
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(n_requests)))
+    return n_requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32]
+    )
+    args = parser.parse_args()
+
+    print(f"{'users':>6} {'blocking req/s':>15} {'async req/s':>12}")
+    for concurrency in args.concurrency:
+        blocking = asyncio.run(
+            run(concurrency, args.requests, _Wait(args.latency, True))
+        )
+        non_blocking = asyncio.run(
+            run(concurrency, args.requests, _Wait(args.latency, False))
+        )
+        print(f"{concurrency:>6} {blocking:>15.1f} {non_blocking:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
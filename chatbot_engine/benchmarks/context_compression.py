@@ -0,0 +1,90 @@
+"""
+Token reduction against evidence kept by the extractive compression.
+
+Every question of the data file comes with the chunks retrieved for it
+and the ``evidence`` strings its answer needs. Chunks of the other
+questions are added until each question has ``--chunks`` of them, like a
+retrieval returning loosely related documents. For every number of
+selected sentences and window, the context is packed with and without
+compression, and the benchmark reports the tokens saved and the share of
+questions whose evidence all survives, the answer quality proxy.
+
+Usage (from chatbot_engine/):
+    python -m benchmarks.context_compression --sentences 2 4 8 --windows 0 1
+"""
+import argparse
+import json
+from pathlib import Path
+
+from langchain.schema import Document
+
+from src.compression import SentenceCompressor
+from src.context_packer import ContextPacker
+
+
+DATA = Path(__file__).parent / "data" / "compression_questions.jsonl"
+
+
+def load_examples(path: Path, n_chunks: int):
+    records = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+    pool = [chunk for record in records for chunk in record["chunks"]]
+
+    examples = []
+    for i, record in enumerate(records):
+        chunks = list(record["chunks"])
+        offset = i * 2
+        while len(chunks) < n_chunks:
+            chunk = pool[(offset + len(chunks)) % len(pool)]
+            if chunk not in chunks:
+                chunks.append(chunk)
+            offset += 1
+        docs = [
+            Document(page_content=text, metadata={"source": source})
+            for source, text in chunks
+        ]
+        examples.append((record["question"], docs, record["evidence"]))
+    return examples
+
+
+def evaluate(examples, compressor: SentenceCompressor, budget: int):
+    plain = ContextPacker(budget)
+    compressed = ContextPacker(budget, compressor=compressor)
+    tokens = compressed_tokens = answered = 0
+    for question, docs, evidence in examples:
+        tokens += plain.pack(docs, query=question).tokens
+        context = compressed.pack(docs, query=question)
+        compressed_tokens += context.tokens
+        answered += all(text in context.text for text in evidence)
+    return tokens, compressed_tokens, answered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--data", type=Path, default=DATA)
+    parser.add_argument("--chunks", type=int, default=4)
+    parser.add_argument("--budget", type=int, default=10000)
+    parser.add_argument("--sentences", type=int, nargs="+",
+                        default=[2, 4, 8])
+    parser.add_argument("--windows", type=int, nargs="+", default=[0, 1])
+    args = parser.parse_args()
+
+    examples = load_examples(args.data, args.chunks)
+    print(f"{len(examples)} questions, {args.chunks} chunks each")
+    print(f"{'sentences':>9} {'window':>6} {'tokens':>7} {'compressed':>10} "
+          f"{'reduction':>9} {'evidence kept':>13}")
+    for sentences in args.sentences:
+        for window in args.windows:
+            tokens, compressed, answered = evaluate(
+                examples, SentenceCompressor(sentences, window), args.budget
+            )
+            print(f"{sentences:>9} {window:>6} {tokens:>7} {compressed:>10} "
+                  f"{1 - compressed / tokens:>9.0%} "
+                  f"{answered / len(examples):>13.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Micro-benchmark of the stream frame serialization.
+
+Compares, per token, the previous path building a validated ChatResponse,
+calling ``.dict()`` and JSON-encoding it like ``send_json``, with
+``encode_stream_frame`` splicing the escaped token into the precomputed
+envelope. Both must produce the same text.
+
+Usage (from chatbot_engine/):
+    python -m benchmarks.frame_encoding --tokens 100000
+"""
+import argparse
+import json
+import time
+
+from src.schemas import ChatResponse, encode_stream_frame
+
+
+def pydantic_frame(token: str) -> str:
+    return json.dumps(
+        ChatResponse(sender="bot", message=token, type="stream").dict()
+    )
+
+
+def measure(encode, tokens) -> float:
+    start = time.perf_counter()
+    for token in tokens:
+        encode(token)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    words = [" SageMaker", " es", " un", " servicio", " \"gestionado\"",
+             " de", " aprendizaje", " automático", ".\n", " 💡"]
+    tokens = [words[i % len(words)] for i in range(args.tokens)]
+    for token in words:
+        assert encode_stream_frame(token) == pydantic_frame(token), token
+
+    print(f"{args.tokens} tokens, best of {args.repeat}")
+    print(f"{'encoder':>20} {'µs/frame':>9} {'frames/s':>10}")
+    baseline = None
+    for name, encode in (
+        ("ChatResponse.dict", pydantic_frame),
+        ("encode_stream_frame", encode_stream_frame),
+    ):
+        best = min(measure(encode, tokens) for _ in range(args.repeat))
+        baseline = baseline or best
+        print(f"{name:>20} {best / args.tokens * 1e6:>9.2f} "
+              f"{args.tokens / best:>10.0f}  ({baseline / best:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
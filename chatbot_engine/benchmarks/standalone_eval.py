@@ -0,0 +1,107 @@
+"""
+Offline evaluation of the standalone question classifier.
+
+Replays hand-written follow up questions, each with the conversation it
+was asked in and whether it had to be rewritten, and reports for every
+similarity threshold how many condense calls are skipped and how many
+needed rewrites are missed.
+
+The bundled data is 25 synthetic English questions: it checks the cues
+against known cases, it does not validate the classifier. The similarity
+threshold still has to be measured on recorded conversations, in the
+languages the chatbot is used in, before STANDALONE_CLASSIFIER is
+enabled.
+
+Every line of the data file is a JSON object with the ``history`` as a
+list of ``[agent, text]`` turns, the ``question`` and the ``rewrite``
+label.
+
+Usage (from chatbot_engine/):
+    python -m benchmarks.standalone_eval --embeddings openai \\
+        --thresholds 0.8 0.85 0.9 0.95
+"""
+import argparse
+import asyncio
+import json
+from pathlib import Path
+
+from src.standalone import STANDALONE_MIN_WORDS, StandaloneClassifier
+from src.turns import Turn
+
+
+DATA = Path(__file__).parent / "data" / "standalone_questions.jsonl"
+
+
+def load_examples(path: Path):
+    examples = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                memory = [
+                    Turn(agent, text, 0.0) for agent, text in record["history"]
+                ]
+                examples.append(
+                    (memory, record["question"], record["rewrite"])
+                )
+    return examples
+
+
+def make_embed(name: str):
+    if name == "none":
+        return None
+    from langchain_community.embeddings import OpenAIEmbeddings
+
+    embeddings = OpenAIEmbeddings()
+    cache = {}
+
+    async def embed(text: str):
+        if text not in cache:
+            cache[text] = await embeddings.aembed_query(text)
+        return cache[text]
+    return embed
+
+
+async def evaluate(examples, classifier: StandaloneClassifier, verbose: bool):
+    skipped = missed = 0
+    for memory, question, rewrite in examples:
+        condense = await classifier.needs_condense(question, memory)
+        skipped += not condense
+        missed += rewrite and not condense
+        if verbose and condense != rewrite:
+            print(f"    {'missed' if rewrite else 'extra'}: {question!r} "
+                  f"(cue: {classifier.cue(question)})")
+    return skipped, missed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--data", type=Path, default=DATA)
+    parser.add_argument("--embeddings", choices=["none", "openai"],
+                        default="none")
+    parser.add_argument("--thresholds", type=float, nargs="+",
+                        default=[0.8, 0.85, 0.9, 0.95])
+    parser.add_argument("--min-words", type=int, default=STANDALONE_MIN_WORDS)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    examples = load_examples(args.data)
+    standalone = sum(not rewrite for _, _, rewrite in examples)
+    embed = make_embed(args.embeddings)
+    thresholds = args.thresholds if embed is not None else [float("inf")]
+    print(f"{len(examples)} questions, {standalone} standalone")
+    print(f"{'threshold':>9} {'skipped':>8} {'standalone skipped':>19} "
+          f"{'missed rewrites':>16}")
+    for threshold in thresholds:
+        classifier = StandaloneClassifier(embed, threshold, args.min_words)
+        skipped, missed = asyncio.run(
+            evaluate(examples, classifier, args.verbose)
+        )
+        label = f"{threshold:.2f}" if threshold <= 1 else "off"
+        print(f"{label:>9} {skipped:>8} "
+              f"{(skipped - missed) / max(standalone, 1):>19.0%} "
+              f"{missed:>16}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Frames and CPU of the websocket token stream, with and without coalescing.
+
+Every stream replays ``--tokens`` tokens through StreamingLLMCallbackHandler
+at ``--rate`` tokens per second, like the LLM does, into a fake writer
+that sends the frames like ``WebSocketWriter`` and the server do: the
+frame is encoded, wrapped in an ASGI ``websocket.send`` message, framed
+as a websocket text frame and written to a socket whose other end is
+drained, one socket pair per stream. For every coalescing
+window, the benchmark reports the frames sent per second over all the
+streams, the process CPU time per stream, and how long a token waits on
+average before reaching the socket.
+
+Usage (from chatbot_engine/):
+    python -m benchmarks.stream_coalescing --streams 50 --windows 0 20 30 50
+"""
+import argparse
+import asyncio
+import socket
+import struct
+import time
+from bisect import bisect_left
+
+from src.callback import (
+    STREAM_COALESCE_CHARS, STREAM_COALESCE_MS, StreamingLLMCallbackHandler
+)
+from src.schemas import encode_stream_frame
+
+
+def websocket_frame(text: str) -> bytes:
+    """Unmasked text frame, as a server sends it."""
+    payload = text.encode()
+    if len(payload) < 126:
+        header = struct.pack("!BB", 0x81, len(payload))
+    elif len(payload) < 1 << 16:
+        header = struct.pack("!BBH", 0x81, 126, len(payload))
+    else:
+        header = struct.pack("!BBQ", 0x81, 127, len(payload))
+    return header + payload
+
+
+async def drain(reader: asyncio.StreamReader) -> None:
+    while await reader.read(1 << 16):
+        pass
+
+
+class FakeWriter:
+    def __init__(self):
+        self.frames = 0
+        self.sent = []
+        self.sent_at = []
+        self._transport = None
+        self._client = None
+
+    async def connect(self) -> asyncio.Task:
+        server, client = socket.socketpair()
+        # The client end must stay referenced, or it is closed
+        reader, self._client = await asyncio.open_connection(sock=client)
+        _, self._transport = await asyncio.open_connection(sock=server)
+        return asyncio.create_task(drain(reader))
+
+    async def send_stream(self, message):
+        asgi = {"type": "websocket.send", "text": encode_stream_frame(message)}
+        self._transport.write(websocket_frame(asgi["text"]))
+        await self._transport.drain()
+        self.frames += 1
+        chars = self.sent[-1] if self.sent else 0
+        self.sent.append(chars + len(message))
+        self.sent_at.append(time.perf_counter())
+
+    async def close(self) -> None:
+        for writer in (self._transport, self._client):
+            writer.close()
+            await writer.wait_closed()
+
+
+async def stream(handler, tokens, interval: float) -> float:
+    """Mean delay between a token and the frame carrying it."""
+    produced, produced_at = 0, []
+    for token in tokens:
+        produced += len(token)
+        produced_at.append((produced, time.perf_counter()))
+        await handler.on_llm_new_token(token)
+        await asyncio.sleep(interval)
+    await handler.on_llm_end(None)
+
+    websocket = handler.websocket
+    delays = [
+        websocket.sent_at[bisect_left(websocket.sent, chars)] - at
+        for chars, at in produced_at
+    ]
+    return sum(delays) / len(delays)
+
+
+async def run(n_streams, tokens, interval, window_ms, max_chars):
+    handlers = [
+        StreamingLLMCallbackHandler(FakeWriter(), window_ms, max_chars)
+        for _ in range(n_streams)
+    ]
+    readers = [await handler.websocket.connect() for handler in handlers]
+    cpu, start = time.process_time(), time.perf_counter()
+    delays = await asyncio.gather(
+        *(stream(handler, tokens, interval) for handler in handlers)
+    )
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    for handler in handlers:
+        await handler.websocket.close()
+    await asyncio.gather(*readers)
+    frames = sum(handler.websocket.frames for handler in handlers)
+    return (
+        frames / elapsed,
+        frames / n_streams,
+        cpu / n_streams,
+        sum(delays) / n_streams,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=100,
+                        help="tokens per second of every stream")
+    # The configured window is always measured
+    parser.add_argument("--windows", type=float, nargs="+",
+                        default=sorted({0, 20, STREAM_COALESCE_MS, 50}))
+    parser.add_argument("--max-chars", type=int,
+                        default=STREAM_COALESCE_CHARS)
+    args = parser.parse_args()
+
+    words = "SageMaker is a fully managed machine learning service".split()
+    tokens = [f" {words[i % len(words)]}" for i in range(args.tokens)]
+    print(f"{args.streams} streams of {args.tokens} tokens "
+          f"at {args.rate:.0f} tokens/s")
+    print(f"{'window ms':>9} {'frames/s':>9} {'frames/stream':>13} "
+          f"{'CPU ms/stream':>13} {'token delay ms':>14}")
+    for window in args.windows:
+        rate, frames, cpu, delay = asyncio.run(run(
+            args.streams, tokens, 1 / args.rate, window, args.max_chars
+        ))
+        print(f"{window:>9.0f} {rate:>9.0f} {frames:>13.0f} "
+              f"{cpu * 1000:>13.1f} {delay * 1000:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Micro-benchmark of the conversation turn codec against the pickle path.
+
+The pickle path serializes the whole conversation (a deque of dicts) on
+every turn, as the handlers used to do, the codec encodes only the new
+turns.
+
+Usage (from chatbot_engine/):
+    python -m benchmarks.turn_codec --text-size 300 --number 20000
+"""
+import argparse
+import pickle
+import timeit
+from collections import deque
+from time import time
+
+from src.turns import ASSISTANT, HUMAN, Turn, decode_turn, encode_turn
+
+
+def make_conversation(text_size: int):
+    text = ("How do I enable data capture on a SageMaker endpoint? "
+            * (text_size // 54 + 1))[:text_size]
+    now = time()
+    return [
+        Turn(HUMAN if i % 2 == 0 else ASSISTANT, f"{i} {text}", now)
+        for i in range(4)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--text-size", type=int, nargs="+",
+                        default=[60, 300, 2000])
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'text':>6} {'path':>7} {'encode us':>10} {'decode us':>10} "
+          f"{'bytes/turn':>11}")
+    for text_size in args.text_size:
+        turns = make_conversation(text_size)
+        memory = deque(
+            [{"Agent": t.agent, "text": t.text, "datetime": t.datetime}
+             for t in turns],
+            maxlen=4
+        )
+        pickled = pickle.dumps(memory)
+        records = [encode_turn(turn) for turn in turns]
+
+        results = {
+            "pickle": (
+                timeit.timeit(lambda: pickle.dumps(memory),
+                              number=args.number),
+                timeit.timeit(lambda: pickle.loads(pickled),
+                              number=args.number),
+                len(pickled) / len(turns),
+            ),
+            "codec": (
+                timeit.timeit(lambda: [encode_turn(t) for t in turns[-2:]],
+                              number=args.number),
+                timeit.timeit(lambda: [decode_turn(r) for r in records],
+                              number=args.number),
+                sum(map(len, records)) / len(records),
+            ),
+        }
+        for path, (encode, decode, size) in results.items():
+            print(f"{text_size:>6} {path:>7} "
+                  f"{encode / args.number * 1e6:>10.2f} "
+                  f"{decode / args.number * 1e6:>10.2f} {size:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
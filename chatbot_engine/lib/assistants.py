@@ -1,3 +1,5 @@
+from typing import Tuple
+
 import pandas as pd
 
 from langchain.callbacks.manager import AsyncCallbackManager
@@ -23,6 +25,9 @@ from langchain.chains.router.llm_router import (
 from langchain.chains.combine_documents.stuff import StuffDocumentsChain
 
 
+from .context_selection import (
+    ContextSelection, SelectingRetriever
+)
 from .custom_chains import (
     CustomConversationalRetrievalChain, MyMultiPromptChain
 )
@@ -845,3 +850,124 @@ def get_simple_assistant(
         model="gpt-3.5-turbo-0613",
     )
     return chat
+
+
+class ChainRegistry:
+    """
+    Process-wide registry of the chains used by the API routes.
+
+    Every chain variant is built once and shares the same ChatOpenAI
+    clients (and therefore their HTTP sessions). Chains are stateless:
+    per-request handlers are passed as ``callbacks`` when calling them,
+    and chat history is passed as an input instead of a chain memory.
+
+    Args:
+        vectorstore (VectorStore): A vector store used for document retrieval.
+        selection (ContextSelection): context selection of the chains of
+            ``get_chain_from_scratch`` and ``get_chain_from_scratch_stream``,
+            applied by the caller retrieving their context
+        stream_selection (ContextSelection): context selection of the
+            retriever of ``get_chain_stream``
+    """
+
+    def __init__(
+        self,
+        vectorstore: VectorStore,
+        selection: ContextSelection = ContextSelection(k=4),
+        stream_selection: ContextSelection = ContextSelection(k=3)
+    ):
+        self.vectorstore = vectorstore
+        self.selection = selection
+        self.stream_selection = stream_selection
+
+        self.llm = ChatOpenAI(
+            model_name="gpt-3.5-turbo-0613",
+            temperature=1,
+            request_timeout=45
+        )
+        self.llm_stream = ChatOpenAI(
+            model_name="gpt-3.5-turbo-0613",
+            streaming=True,
+            temperature=1,
+            request_timeout=45,
+            max_retries=2
+        )
+        self.question_gen_llm = ChatOpenAI(
+            model_name="gpt-3.5-turbo-0613",
+            streaming=True,
+            temperature=0,
+            verbose=False
+        )
+
+        self.memory_chain = LLMChain(
+            llm=self.llm,
+            prompt=CONDENSE_QUESTION_PROMPT,
+            output_key="new_question",
+            verbose=False
+        )
+        self.question_chain = LLMChain(
+            llm=self.llm,
+            prompt=QA_PROMPT,
+            output_key="answer",
+            verbose=True
+        )
+        self.question_chain_stream = LLMChain(
+            llm=self.llm_stream,
+            prompt=QA_PROMPT,
+            output_key="answer",
+            verbose=True
+        )
+        self.retrieval_chain_stream = ConversationalRetrievalChain(
+            retriever=SelectingRetriever(
+                vectorstore=vectorstore,
+                selection=stream_selection,
+                # Cosine similarity, the relevance score the former
+                # similarity_score_threshold retriever used for Qdrant
+                score_threshold=0.7
+            ),
+            combine_docs_chain=load_qa_chain(
+                self.llm_stream,
+                chain_type="stuff",
+                prompt=QA_PROMPT,
+                verbose=True
+            ),
+            question_generator=LLMChain(
+                llm=self.question_gen_llm,
+                prompt=CONDENSE_QUESTION_PROMPT,
+                verbose=True,
+                output_key="question"
+            ),
+            verbose=True
+        )
+
+    def get_chain_from_scratch(self) -> Tuple[LLMChain, LLMChain]:
+        """
+        Shared counterpart of ``get_chain_from_scratch``
+
+        Returns:
+            LLMChain: memory_chain
+            LLMChain: question_chain
+        """
+        return self.memory_chain, self.question_chain
+
+    def get_chain_from_scratch_stream(self) -> Tuple[LLMChain, LLMChain]:
+        """
+        Shared counterpart of ``get_chain_from_scratch_stream``, the
+        stream handler must be passed as ``callbacks`` to question_chain
+
+        Returns:
+            LLMChain: memory_chain
+            LLMChain: question_chain (Streaming)
+        """
+        return self.memory_chain, self.question_chain_stream
+
+    def get_chain_stream(self) -> ConversationalRetrievalChain:
+        """
+        Shared counterpart of ``get_chain_stream``. It has no memory, so
+        ``chat_history`` must be passed as input and the callback handler
+        as ``callbacks``
+
+        Returns:
+            ConversationalRetrievalChain: A ConversationalRetrievalChain
+        """
+        return self.retrieval_chain_stream
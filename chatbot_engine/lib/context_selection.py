@@ -0,0 +1,290 @@
+"""
+Selection of the retrieved chunks sent as context: adaptive k on the score
+gap, near-duplicate filtering and maximal marginal relevance (MMR).
+"""
+import asyncio
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun
+)
+from langchain.schema import BaseRetriever, Document
+from langchain.vectorstores.base import VectorStore
+from langchain_community.vectorstores import Qdrant
+
+
+CONTEXT_FETCH_K = int(os.getenv("CONTEXT_FETCH_K", 20))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", 0.7))
+CONTEXT_REDUNDANCY_THRESHOLD = float(
+    os.getenv("CONTEXT_REDUNDANCY_THRESHOLD", 0.95)
+)
+CONTEXT_SCORE_GAP = float(os.getenv("CONTEXT_SCORE_GAP", 0.1))
+
+# A retrieved chunk, its similarity to the query and its embedding
+Candidate = Tuple[Document, float, List[float]]
+
+
+class ContextSelection(NamedTuple):
+    """
+    How to pick the context chunks among the retrieved candidates.
+
+    Args:
+        k (int): maximum number of chunks
+        fetch_k (int): number of candidates retrieved
+        mmr_lambda (float): weight of relevance against diversity in MMR,
+            None keeps the ``k`` most relevant chunks
+        redundancy_threshold (float): cosine similarity above which a chunk
+            duplicates a more relevant one, None keeps duplicates
+        score_gap (float): drop of relevance between two consecutive
+            candidates after which the rest is discarded, None disables it
+        min_k (int): minimum number of chunks kept by the score gap
+    """
+    k: int = 4
+    fetch_k: int = CONTEXT_FETCH_K
+    mmr_lambda: Optional[float] = CONTEXT_MMR_LAMBDA
+    redundancy_threshold: Optional[float] = CONTEXT_REDUNDANCY_THRESHOLD
+    score_gap: Optional[float] = CONTEXT_SCORE_GAP
+    min_k: int = 1
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def adaptive_k(scores: np.ndarray, score_gap: float, min_k: int = 1) -> int:
+    """Number of leading ``scores`` (sorted) before the first large gap."""
+    gaps = np.flatnonzero(scores[:-1] - scores[1:] >= score_gap) + 1
+    gaps = gaps[gaps >= min_k]
+    return int(gaps[0]) if len(gaps) else len(scores)
+
+
+def redundancy_filter(similarities: np.ndarray, threshold: float) -> List[int]:
+    """
+    Indices of the candidates, in rank order, that are not more than
+    ``threshold`` similar to a candidate ranked before them.
+    """
+    kept = [0]
+    for i in range(1, len(similarities)):
+        if similarities[i, kept].max() < threshold:
+            kept.append(i)
+    return kept
+
+
+def mmr(
+    relevance: np.ndarray,
+    similarities: np.ndarray,
+    k: int,
+    mmr_lambda: float
+) -> List[int]:
+    """
+    Maximal marginal relevance: greedily pick the candidate maximizing
+    ``mmr_lambda * relevance - (1 - mmr_lambda) * max similarity`` to the
+    ones already picked.
+    """
+    selected = [int(np.argmax(relevance))]
+    closest = similarities[selected[0]].copy()
+    while len(selected) < min(k, len(relevance)):
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * closest
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        closest = np.maximum(closest, similarities[best])
+    return selected
+
+
+def _point_vector(vectorstore: Qdrant, point: Any) -> List[float]:
+    if vectorstore.vector_name is not None:
+        return point.vector[vectorstore.vector_name]
+    return point.vector
+
+
+def _qdrant_query(vectorstore: Qdrant, embedding: List[float], k: int):
+    return dict(
+        collection_name=vectorstore.collection_name,
+        query=embedding,
+        using=vectorstore.vector_name,
+        limit=k,
+        with_payload=True,
+        with_vectors=True,
+    )
+
+
+def _qdrant_candidates(vectorstore: Qdrant, points) -> List[Candidate]:
+    return [
+        (
+            vectorstore._document_from_scored_point(
+                point,
+                vectorstore.collection_name,
+                vectorstore.content_payload_key,
+                vectorstore.metadata_payload_key,
+            ),
+            point.score,
+            _point_vector(vectorstore, point),
+        )
+        for point in points
+    ]
+
+
+def search_with_vectors(
+    vectorstore: VectorStore,
+    embedding: List[float],
+    k: int
+) -> List[Candidate]:
+    """
+    The ``k`` chunks closest to ``embedding``, returned with their stored
+    embeddings by the same search, so they are never embedded again.
+    Other stores than Qdrant must implement
+    ``similarity_search_with_vectors_by_vector``.
+    """
+    if isinstance(vectorstore, Qdrant):
+        response = vectorstore.client.query_points(
+            **_qdrant_query(vectorstore, embedding, k)
+        )
+        return _qdrant_candidates(vectorstore, response.points)
+    return vectorstore.similarity_search_with_vectors_by_vector(embedding, k)
+
+
+async def asearch_with_vectors(
+    vectorstore: VectorStore,
+    embedding: List[float],
+    k: int
+) -> List[Candidate]:
+    """Async ``search_with_vectors``."""
+    if isinstance(vectorstore, Qdrant):
+        if vectorstore.async_client is None:
+            return await asyncio.to_thread(
+                search_with_vectors, vectorstore, embedding, k
+            )
+        response = await vectorstore.async_client.query_points(
+            **_qdrant_query(vectorstore, embedding, k)
+        )
+        return _qdrant_candidates(vectorstore, response.points)
+    return await vectorstore.asimilarity_search_with_vectors_by_vector(
+        embedding, k
+    )
+
+
+async def afetch_vectors(
+    vectorstore: VectorStore,
+    ids: List[str]
+) -> Dict[str, List[float]]:
+    """Stored embeddings of the points ``ids``, the missing ones omitted."""
+    if isinstance(vectorstore, Qdrant):
+        client = vectorstore.async_client
+        kwargs = dict(
+            collection_name=vectorstore.collection_name,
+            # Point ids are unsigned integers or UUIDs
+            ids=[int(i) if i.isdigit() else i for i in ids],
+            with_payload=False,
+            with_vectors=True,
+        )
+        points = await client.retrieve(**kwargs) if client is not None \
+            else await asyncio.to_thread(vectorstore.client.retrieve, **kwargs)
+        return {
+            str(point.id): _point_vector(vectorstore, point)
+            for point in points
+        }
+    return vectorstore.vectors_by_id(ids)
+
+
+def select_context(
+    query: List[float],
+    candidates: List[List[float]],
+    selection: ContextSelection
+) -> List[int]:
+    """
+    Pick the context among candidate chunks from their embeddings.
+
+    Args:
+        query (list): embedding of the question
+        candidates (list): embeddings of the candidate chunks
+        selection (ContextSelection): selection parameters
+
+    Returns:
+        list: indices of the selected candidates, most relevant first
+    """
+    if not candidates:
+        return []
+    vectors = _normalize(np.asarray(candidates, dtype=np.float32))
+    relevance = vectors @ _normalize(np.asarray(query, dtype=np.float32))
+    order = np.argsort(-relevance, kind="stable")
+    vectors, relevance = vectors[order], relevance[order]
+
+    n = len(order)
+    if selection.score_gap is not None:
+        n = adaptive_k(relevance, selection.score_gap, selection.min_k)
+    similarities = vectors[:n] @ vectors[:n].T
+    kept = np.arange(n)
+    if selection.redundancy_threshold is not None:
+        kept = np.asarray(
+            redundancy_filter(similarities, selection.redundancy_threshold)
+        )
+    if selection.mmr_lambda is None:
+        picked = kept[:selection.k]
+    else:
+        picked = kept[mmr(
+            relevance[kept],
+            similarities[np.ix_(kept, kept)],
+            selection.k,
+            selection.mmr_lambda,
+        )]
+    picked = sorted(picked, key=lambda i: -relevance[i])
+    return [int(order[i]) for i in picked]
+
+
+class SelectingRetriever(BaseRetriever):
+    """
+    Retriever fetching ``fetch_k`` candidates from a vector store, with
+    their embeddings, and returning the chunks picked by
+    ``select_context``.
+
+    ``score_threshold`` applies to the cosine similarity of the candidates
+    to the query, the relevance score langchain reports for Qdrant
+    collections with the cosine distance.
+    """
+    vectorstore: VectorStore
+    selection: ContextSelection = ContextSelection()
+    score_threshold: Optional[float] = None
+
+    def _select(
+        self,
+        query: List[float],
+        candidates: List[Candidate]
+    ) -> List[Document]:
+        candidates = [
+            candidate for candidate in candidates
+            if self.score_threshold is None
+            or candidate[1] >= self.score_threshold
+        ]
+        indices = select_context(
+            query, [vector for _, _, vector in candidates], self.selection
+        )
+        return [candidates[i][0] for i in indices]
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        embedding = self.vectorstore.embeddings.embed_query(query)
+        candidates = search_with_vectors(
+            self.vectorstore, embedding, self.selection.fetch_k
+        )
+        return self._select(embedding, candidates)
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        embedding = await self.vectorstore.embeddings.aembed_query(query)
+        candidates = await asearch_with_vectors(
+            self.vectorstore, embedding, self.selection.fetch_k
+        )
+        return self._select(embedding, candidates)
@@ -8,9 +8,13 @@ from langchain.callbacks.manager import (
     AsyncCallbackManagerForChainRun,
     CallbackManagerForChainRun
 )
+from langchain.schema import Document
 from langchain.schema.messages import BaseMessage
 from langchain.agents.agent import AgentExecutor
 
+from .speculative import SPECULATIVE_MERGE_OVERLAP, SPECULATIVE_RETRIEVAL, \
+    speculative_search
+
 
 
 CHAT_TURN_TYPE = Union[Tuple[str, str], BaseMessage]
@@ -44,7 +48,13 @@ class CustomConversationalRetrievalChain(
     """
     Create a custom ConversationalRetrievalChain for handling \
         customize inputs and outputs values
+
+    In speculative mode, the async call retrieves documents for the raw
+    question while it is condensed, see ``speculative_search``.
     """
+    speculative_retrieval: bool = SPECULATIVE_RETRIEVAL
+    speculative_merge_overlap: float = SPECULATIVE_MERGE_OVERLAP
+
     @property
     def input_keys(self) -> List[str]:
         """Input keys."""
@@ -107,24 +117,35 @@ class CustomConversationalRetrievalChain(
         question = inputs["input"]
         get_chat_history = self.get_chat_history or _get_chat_history
         chat_history_str = get_chat_history(inputs["chat_history"])
+        accepts_run_manager = (
+            "run_manager" in inspect.signature(self._aget_docs).parameters
+        )
+
+        async def aget_docs(query: str) -> List[Document]:
+            if accepts_run_manager:
+                return await self._aget_docs(
+                    query, inputs, run_manager=_run_manager
+                )
+            return await self._aget_docs(query, inputs)
+
         if chat_history_str:
             callbacks = _run_manager.get_child()
-            new_question = await self.question_generator.arun(
+            condense = self.question_generator.arun(
                 input=question,
                 chat_history=chat_history_str,
                 callbacks=callbacks
             )
+            if self.speculative_retrieval:
+                new_question, docs, _ = await speculative_search(
+                    question, condense, aget_docs,
+                    self.speculative_merge_overlap
+                )
+            else:
+                new_question = await condense
+                docs = await aget_docs(new_question)
         else:
             new_question = question
-        accepts_run_manager = (
-            "run_manager" in inspect.signature(self._aget_docs).parameters
-        )
-        if accepts_run_manager:
-            docs = await self._aget_docs(
-                new_question, inputs, run_manager=_run_manager
-            )
-        else:
-            docs = await self._aget_docs(new_question, inputs)
+            docs = await aget_docs(new_question)
 
         new_inputs = inputs.copy()
         if self.rephrase_question:
@@ -0,0 +1,124 @@
+"""
+Speculative retrieval on the raw follow up question, started while the
+question is being condensed into a standalone one.
+"""
+import asyncio
+import os
+import re
+from itertools import zip_longest
+from typing import Awaitable, Callable, List, Set, Tuple
+
+from langchain.schema import Document
+
+
+SPECULATIVE_RETRIEVAL = os.getenv(
+    "SPECULATIVE_RETRIEVAL", "true"
+).lower() in ("1", "true", "yes")
+# Share of the terms of the standalone question found in the raw question
+# above which both retrievals are merged instead of discarding the raw one
+SPECULATIVE_MERGE_OVERLAP = float(os.getenv("SPECULATIVE_MERGE_OVERLAP", 0.5))
+
+KEEP = "keep"
+MERGE = "merge"
+DISCARD = "discard"
+
+_STOPWORDS = frozenset("""
+a about an and any are as at be been but by can could did do does for from
+had has have how i if in into is it its me my of on or our please should so
+than that the their them then there these they this those to was we were
+what when where which who why will with would you your
+""".split())
+
+Search = Callable[[str], Awaitable[List[Document]]]
+
+
+def content_terms(text: str) -> Set[str]:
+    return {
+        term for term in re.findall(r"\w+", text.lower())
+        if term not in _STOPWORDS
+    }
+
+
+def verdict(
+    question: str,
+    new_question: str,
+    merge_overlap: float = SPECULATIVE_MERGE_OVERLAP
+) -> str:
+    """
+    Decide what to do with the documents retrieved for the raw question.
+
+    They are kept when condensing added no term to the question, which was
+    then already standalone, merged with the documents of the standalone
+    question when it mostly rephrases the raw one, and discarded otherwise.
+    """
+    raw, new = content_terms(question), content_terms(new_question)
+    if not new - raw:
+        return KEEP
+    if len(new & raw) / len(new) >= merge_overlap:
+        return MERGE
+    return DISCARD
+
+
+def merge_documents(
+    primary: List[Document],
+    secondary: List[Document],
+    k: int
+) -> List[Document]:
+    """First ``k`` distinct documents of both lists, taken in turns."""
+    merged, seen = [], set()
+    pairs = zip_longest(primary, secondary)
+    for doc in (doc for pair in pairs for doc in pair if doc is not None):
+        key = (doc.metadata.get("source"), doc.page_content)
+        if key not in seen:
+            seen.add(key)
+            merged.append(doc)
+    return merged[:k]
+
+
+def _ignore_result(task: asyncio.Future) -> None:
+    if not task.cancelled():
+        task.exception()
+
+
+async def speculative_search(
+    question: str,
+    condense: Awaitable[str],
+    search: Search,
+    merge_overlap: float = SPECULATIVE_MERGE_OVERLAP
+) -> Tuple[str, List[Document], str]:
+    """
+    Search documents for the raw question while it is condensed.
+
+    Args:
+        question (str): raw follow up question
+        condense (Awaitable[str]): condensation of the question
+        search (Callable): coroutine function retrieving the documents of
+            a question
+        merge_overlap (float): see ``verdict``
+
+    Returns:
+        str: standalone question
+        list: documents retrieved for it
+        str: what was done with the speculative documents
+    """
+    speculative = asyncio.ensure_future(search(question))
+    speculative.add_done_callback(_ignore_result)
+    try:
+        new_question = await condense
+    except BaseException:
+        speculative.cancel()
+        raise
+
+    decision = verdict(question, new_question, merge_overlap)
+    if decision == KEEP:
+        return new_question, await speculative, decision
+    if decision == DISCARD:
+        speculative.cancel()
+        return new_question, await search(new_question), decision
+
+    docs = await search(new_question)
+    try:
+        extra = await speculative
+    except Exception:
+        extra = []
+    return new_question, merge_documents(docs, extra, len(docs)), decision
@@ -0,0 +1,79 @@
+"""Two-level (in-process LRU plus Redis) cache."""
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Dict, Optional
+
+import msgpack
+
+
+class TwoLevelCache:
+    """
+    Cache looked up first in a bounded in-process LRU and then in Redis,
+    shared by every worker. Values must be msgpack serializable.
+
+    Args:
+        redis_client (redis.asyncio.Redis): client of the shared level
+        namespace (str): prefix of the Redis keys
+        maxsize (int): maximum number of entries of the in-process level
+        ttl (int): seconds an entry lives in either level, None to keep it
+            forever
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        namespace: str,
+        maxsize: int = 1024,
+        ttl: Optional[int] = None
+    ):
+        self.redis_client = redis_client
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = OrderedDict()
+        self.hits_local = 0
+        self.hits_shared = 0
+        self.misses = 0
+
+    def _redis_key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _set_local(self, key: str, value: Any) -> None:
+        expires_at = None if self.ttl is None else monotonic() + self.ttl
+        self._local[key] = (expires_at, value)
+        self._local.move_to_end(key)
+        if len(self._local) > self.maxsize:
+            self._local.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Any]:
+        if key in self._local:
+            expires_at, value = self._local[key]
+            if expires_at is None or monotonic() < expires_at:
+                self._local.move_to_end(key)
+                self.hits_local += 1
+                return value
+            del self._local[key]
+
+        record = await self.redis_client.get(self._redis_key(key))
+        if record is None:
+            self.misses += 1
+            return None
+
+        value = msgpack.unpackb(record)
+        self._set_local(key, value)
+        self.hits_shared += 1
+        return value
+
+    async def set(self, key: str, value: Any) -> None:
+        self._set_local(key, value)
+        await self.redis_client.set(
+            self._redis_key(key), msgpack.packb(value), ex=self.ttl
+        )
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits_local": self.hits_local,
+            "hits_shared": self.hits_shared,
+            "misses": self.misses,
+            "size_local": len(self._local),
+        }
@@ -1,20 +1,117 @@
 """Callback handlers used in the app."""
-from typing import Any, Dict, List
+import asyncio
+import os
+import re
+from typing import Any, Dict, List, Optional
 
 from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.schema import LLMResult
 
 from .schemas import ChatResponse
 
 
+# Milliseconds tokens are buffered before being sent as one stream frame,
+# 0 sends a frame per token. A window not longer than the interval between
+# two tokens still sends a frame per token, plus a timer
+STREAM_COALESCE_MS = float(os.getenv("STREAM_COALESCE_MS", 30))
+# Buffered characters that send a stream frame before the window ends
+STREAM_COALESCE_CHARS = int(os.getenv("STREAM_COALESCE_CHARS", 64))
+
+
+def _ignore_result(task: asyncio.Future) -> None:
+    if not task.cancelled():
+        task.exception()
+
+
 class StreamingLLMCallbackHandler(AsyncCallbackHandler):
-    """Callback handler for streaming LLM responses."""
+    """
+    Callback handler for streaming LLM responses.
 
-    def __init__(self, websocket):
+    Frames are queued with ``send_stream`` on the ``WebSocketWriter`` of
+    the connection. Tokens are coalesced into one ``stream`` frame per
+    ``window_ms``, or as soon as ``max_chars`` characters are buffered,
+    instead of a frame per token. Buffered tokens are flushed when the LLM
+    ends, and callers must ``flush`` before sending the ``end`` frame.
+
+    Args:
+        websocket (WebSocketWriter): writer of the connection
+        window_ms (float): buffering window, 0 disables coalescing
+        max_chars (int): buffered characters flushed right away
+    """
+
+    # Let the WebSocketDisconnect of a slow client stop the LLM call,
+    # LangChain only logs the errors of the other handlers
+    raise_error = True
+
+    def __init__(
+        self,
+        websocket,
+        window_ms: float = STREAM_COALESCE_MS,
+        max_chars: int = STREAM_COALESCE_CHARS
+    ):
         self.websocket = websocket
+        self.window = window_ms / 1000
+        self.max_chars = max_chars
+        self._buffer: List[str] = []
+        self._size = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Frames are sent in the order their tokens were buffered
+        self._lock = asyncio.Lock()
+
+    async def _send(self, message: str) -> None:
+        await self.websocket.send_stream(message)
 
     async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
-        resp = ChatResponse(sender="bot", message=token, type="stream")
-        await self.websocket.send_json(resp.dict())
+        if not self.window:
+            async with self._lock:
+                await self._send(token)
+            return
+        self._buffer.append(token)
+        self._size += len(token)
+        if self._size >= self.max_chars:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.window, self._flush_later
+            )
+
+    def _flush_later(self) -> None:
+        self._timer = None
+        task = asyncio.ensure_future(self.flush())
+        task.add_done_callback(_ignore_result)
+
+    async def flush(self) -> None:
+        """Send the buffered tokens as one stream frame."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._buffer:
+            return
+        message = "".join(self._buffer)
+        self._buffer.clear()
+        self._size = 0
+        async with self._lock:
+            await self._send(message)
+
+    def discard(self) -> None:
+        """Drop the buffered tokens of a cancelled answer."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._buffer.clear()
+        self._size = 0
+
+    async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        await self.flush()
+
+    async def on_llm_error(self, error: BaseException, **kwargs: Any) -> None:
+        await self.flush()
+
+    async def replay(self, text: str) -> None:
+        """Send an already known answer as stream frames, word by word."""
+        for token in re.findall(r"\s*\S+", text):
+            await self.on_llm_new_token(token)
+        await self.flush()
 
 
 class QuestionGenCallbackHandler(AsyncCallbackHandler):
@@ -0,0 +1,140 @@
+"""Extractive compression of the retrieved context, sentence by sentence."""
+import os
+import re
+import zlib
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from lib.speculative import content_terms
+
+
+CONTEXT_COMPRESSION = os.getenv(
+    "CONTEXT_COMPRESSION", "false"
+).lower() in ("1", "true", "yes")
+# Sentences of the retrieved context most similar to the question kept
+COMPRESSION_SENTENCES = int(os.getenv("COMPRESSION_SENTENCES", 8))
+# Neighbouring sentences kept on each side of a selected one
+COMPRESSION_WINDOW = int(os.getenv("COMPRESSION_WINDOW", 1))
+# Dimension of the hashed term vectors
+COMPRESSION_FEATURES = 2 ** 12
+
+# Sentence ends, and line breaks of lists and tables, captured so the
+# sentences kept are joined back with their original separator
+_SENTENCE_END = re.compile(r"((?<=[.!?])\s+(?=\S)|\s*\n\s*)")
+# Marks the sentences elided between two kept ones
+GAP = "[...]"
+
+
+def split_sentences(text: str) -> List[Tuple[str, str]]:
+    """Sentences of ``text``, each with the separator following it."""
+    pieces = _SENTENCE_END.split(text)
+    return [
+        (sentence.strip(), separator)
+        for sentence, separator in zip(pieces[::2], pieces[1::2] + [""])
+        if sentence.strip()
+    ]
+
+
+def _features(text: str) -> List[int]:
+    terms = sorted(content_terms(text))
+    return [
+        zlib.crc32(term.encode()) % COMPRESSION_FEATURES for term in terms
+    ]
+
+
+def sentence_scores(query: str, sentences: List[str]) -> np.ndarray:
+    """
+    Cosine similarity of every sentence to the query, on hashed term
+    vectors weighted by the inverse sentence frequency of the terms.
+    """
+    matrix = np.zeros((len(sentences), COMPRESSION_FEATURES), np.float32)
+    for row, sentence in enumerate(sentences):
+        matrix[row, _features(sentence)] = 1.0
+    query_vector = np.zeros(COMPRESSION_FEATURES, np.float32)
+    query_vector[_features(query)] = 1.0
+
+    frequency = matrix.sum(axis=0)
+    idf = np.log1p(len(sentences) / (1.0 + frequency)).astype(np.float32)
+    matrix *= idf
+    query_vector *= idf
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vector)
+    return matrix @ query_vector / np.maximum(norms, 1e-12)
+
+
+class SentenceCompressor:
+    """
+    Keep the sentences of the retrieved passages that answer the question.
+
+    All the sentences of a request are scored against the question in one
+    matrix-vector product, locally and without any model call. The
+    ``max_sentences`` best ones are kept with ``window`` neighbours on each
+    side, in their original order and with the line breaks or spaces that
+    followed them, elided runs being marked with ``GAP``.
+    Passages without any kept sentence are dropped, and nothing is
+    compressed when no sentence shares a term with the question.
+
+    Args:
+        max_sentences (int): number of sentences selected by score
+        window (int): neighbours kept around a selected sentence
+    """
+
+    def __init__(
+        self,
+        max_sentences: int = COMPRESSION_SENTENCES,
+        window: int = COMPRESSION_WINDOW
+    ):
+        self.max_sentences = max_sentences
+        self.window = window
+        self.sentences = 0
+        self.kept = 0
+
+    def compress(self, query: str, texts: List[str]) -> List[str]:
+        """Compressed ``texts``, an empty string for dropped ones."""
+        split = [split_sentences(text) for text in texts]
+        positions: List[Tuple[int, int]] = [
+            (i, j) for i, sentences in enumerate(split)
+            for j in range(len(sentences))
+        ]
+        self.sentences += len(positions)
+        if len(positions) <= self.max_sentences:
+            self.kept += len(positions)
+            return texts
+
+        scores = sentence_scores(
+            query, [split[i][j][0] for i, j in positions]
+        )
+        if not scores.any():
+            self.kept += len(positions)
+            return texts
+        best = np.argsort(-scores, kind="stable")[:self.max_sentences]
+        kept = [set() for _ in texts]
+        for index in best:
+            if scores[index] <= 0:
+                break
+            i, j = positions[index]
+            kept[i].update(range(
+                max(0, j - self.window),
+                min(len(split[i]), j + self.window + 1),
+            ))
+
+        compressed = []
+        for sentences, indices in zip(split, kept):
+            self.kept += len(indices)
+            parts, previous = [], None
+            for j in sorted(indices):
+                if previous is not None:
+                    parts.append(sentences[previous][1])
+                    if j > previous + 1:
+                        parts.extend((GAP, sentences[j - 1][1]))
+                parts.append(sentences[j][0])
+                previous = j
+            compressed.append("".join(parts))
+        return compressed
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "sentences": self.sentences,
+            "kept": self.kept,
+            "ratio": self.kept / self.sentences if self.sentences else 1.0,
+        }
@@ -0,0 +1,227 @@
+"""Token-budgeted packing of the retrieved chunks into the prompt context."""
+import logging
+import os
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional
+
+import tiktoken
+from langchain.schema import Document
+
+from .compression import SentenceCompressor
+from .utils import format_docs
+
+
+# Tokens of context sent to the question chain
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+# Shortest overlap, in characters, merging two chunks of the same source
+CONTEXT_MIN_OVERLAP = int(os.getenv("CONTEXT_MIN_OVERLAP", 20))
+# Model whose tokenizer counts the context tokens
+CONTEXT_TOKENIZER_MODEL = os.getenv("CONTEXT_TOKENIZER_MODEL", "gpt-3.5-turbo")
+# Fewest tokens of a passage worth sending truncated
+CONTEXT_MIN_PASSAGE_TOKENS = 50
+# Characters per token when the tokenizer cannot be loaded
+CHARS_PER_TOKEN = 4
+
+
+class Passage(NamedTuple):
+    source: Optional[str]
+    text: str
+    rank: int
+
+
+class PackedContext(NamedTuple):
+    text: str
+    tokens: int
+    saved_tokens: int
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str) -> Optional[tiktoken.Encoding]:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception as e:
+        # The BPE ranks are downloaded on first use
+        logging.warning(f"Tokenizer of {model} unavailable, estimating: {e}")
+        return None
+
+
+def count_tokens(text: str, model: str = CONTEXT_TOKENIZER_MODEL) -> int:
+    encoding = _encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+
+def truncate_tokens(
+    text: str,
+    max_tokens: int,
+    model: str = CONTEXT_TOKENIZER_MODEL
+) -> str:
+    """Longest prefix of ``text`` within ``max_tokens``, cut between words."""
+    encoding = _encoding(model)
+    if encoding is None:
+        prefix = text[:max_tokens * CHARS_PER_TOKEN]
+    else:
+        prefix = encoding.decode(encoding.encode(text)[:max_tokens])
+    if len(prefix) < len(text) and " " in prefix:
+        prefix = prefix[:prefix.rindex(" ")]
+    return prefix
+
+
+def overlap(
+    left: str,
+    right: str,
+    min_overlap: int = CONTEXT_MIN_OVERLAP
+) -> int:
+    """
+    Length of the longest suffix of ``left`` that starts ``right``, the
+    length of ``right`` when ``left`` contains it, 0 below ``min_overlap``.
+    """
+    if len(right) >= min_overlap and right in left:
+        return len(right)
+    head = right[:min_overlap]
+    if len(head) < min_overlap:
+        return 0
+    position = left.find(head, max(0, len(left) - len(right)))
+    while position != -1:
+        if right.startswith(left[position:]):
+            return len(left) - position
+        position = left.find(head, position + 1)
+    return 0
+
+
+def merge_passages(
+    docs: List[Document],
+    min_overlap: int = CONTEXT_MIN_OVERLAP
+) -> List[Passage]:
+    """
+    Join the chunks of a source that overlap, as consecutive chunks of the
+    splitter do, keeping their overlap once. A passage keeps the best rank
+    of its chunks.
+    """
+    passages = [
+        Passage(doc.metadata.get("source"), doc.page_content, rank)
+        for rank, doc in enumerate(docs)
+    ]
+    merged = True
+    while merged:
+        merged = False
+        for i, first in enumerate(passages):
+            for j, second in enumerate(passages):
+                if i == j or first.source is None \
+                        or first.source != second.source:
+                    continue
+                size = overlap(first.text, second.text, min_overlap)
+                if size:
+                    passages[i] = Passage(
+                        first.source,
+                        first.text + second.text[size:],
+                        min(first.rank, second.rank),
+                    )
+                    del passages[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return sorted(passages, key=lambda passage: passage.rank)
+
+
+def _format(passage: Passage) -> str:
+    metadata = {"source": passage.source} if passage.source else {}
+    return format_docs(
+        [Document(page_content=passage.text, metadata=metadata)]
+    )
+
+
+class ContextPacker:
+    """
+    Build the context of the question chain within a token budget.
+
+    Overlapping chunks of the same source are merged, and optionally
+    compressed to the sentences answering the question, then passages are
+    added by retrieval rank while they fit in the budget. The first passage
+    that does not fit is truncated if enough of the budget is left, and
+    later ones that still fit are added. Passages are formatted like
+    ``format_docs``.
+
+    Args:
+        budget (int): default number of tokens of the context
+        min_overlap (int): see ``overlap``
+        model (str): model whose tokenizer counts the tokens
+        compressor (SentenceCompressor): extractive compression of the
+            passages, applied when a query is given
+    """
+
+    def __init__(
+        self,
+        budget: int = CONTEXT_TOKEN_BUDGET,
+        min_overlap: int = CONTEXT_MIN_OVERLAP,
+        model: str = CONTEXT_TOKENIZER_MODEL,
+        compressor: Optional[SentenceCompressor] = None
+    ):
+        self.budget = budget
+        self.min_overlap = min_overlap
+        self.model = model
+        self.compressor = compressor
+        self.packed = 0
+        self.tokens = 0
+        self.saved_tokens = 0
+
+    def load_tokenizer(self) -> None:
+        """Load the tokenizer, its BPE ranks are downloaded on first use."""
+        _encoding(self.model)
+
+    def pack(
+        self,
+        docs: List[Document],
+        budget: Optional[int] = None,
+        query: Optional[str] = None
+    ) -> PackedContext:
+        """Context of ``docs`` for ``query`` within ``budget`` tokens."""
+        budget = self.budget if budget is None else budget
+        passages = merge_passages(docs, self.min_overlap)
+        if self.compressor is not None and query:
+            texts = self.compressor.compress(
+                query, [passage.text for passage in passages]
+            )
+            passages = [
+                passage._replace(text=text)
+                for passage, text in zip(passages, texts) if text
+            ]
+
+        separator = count_tokens("\n\n", self.model)
+        selected, used = [], 0
+        for passage in passages:
+            cost = count_tokens(_format(passage), self.model) \
+                + separator * bool(selected)
+            if used + cost > budget:
+                overhead = count_tokens(
+                    _format(passage._replace(text="")), self.model
+                ) + separator * bool(selected)
+                room = budget - used - overhead
+                if room < CONTEXT_MIN_PASSAGE_TOKENS:
+                    continue
+                passage = passage._replace(
+                    text=truncate_tokens(passage.text, room, self.model)
+                )
+                cost = overhead + count_tokens(passage.text, self.model)
+            selected.append(passage)
+            used += cost
+
+        text = "\n\n".join(_format(passage) for passage in selected)
+        tokens = count_tokens(text, self.model)
+        saved = max(0, count_tokens(format_docs(docs), self.model) - tokens)
+        self.packed += 1
+        self.tokens += tokens
+        self.saved_tokens += saved
+        return PackedContext(text, tokens, saved)
+
+    def stats(self) -> Dict:
+        stats = {
+            "packed": self.packed,
+            "tokens": self.tokens,
+            "saved_tokens": self.saved_tokens,
+        }
+        if self.compressor is not None:
+            stats["compression"] = self.compressor.stats()
+        return stats
@@ -0,0 +1,235 @@
+"""Batched, concurrency-limited embedding and upsert stage of ingestion."""
+import asyncio
+import logging
+import os
+import random
+from itertools import islice
+from time import monotonic
+from typing import (
+    Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+)
+
+from langchain.schema import Document
+
+from .embedding_store import EmbeddingStore
+
+
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 4))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", 6))
+# Seconds of the first backoff after a rate limit, doubled on each retry
+EMBEDDING_BACKOFF = float(os.getenv("EMBEDDING_BACKOFF", 1))
+
+Batch = Tuple[List[str], List[Document]]
+Upsert = Callable[[List[str], List[Document], List[List[float]]], None]
+
+
+def is_rate_limit(error: Exception) -> bool:
+    status = getattr(error, "http_status", None) \
+        or getattr(error, "status_code", None)
+    return status == 429 or type(error).__name__ == "RateLimitError"
+
+
+def batched(
+    items: Iterable[Tuple[str, Document]],
+    batch_size: int
+) -> Iterator[Batch]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        ids, chunks = zip(*batch)
+        yield list(ids), list(chunks)
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that is halved on every rate limit and grows back by
+    one on every success (AIMD), with a shared pause after rate limits.
+
+    Args:
+        limit (int): maximum number of concurrent requests
+    """
+
+    def __init__(self, limit: int):
+        self.max_limit = limit
+        self.limit = limit
+        self.active = 0
+        self.resume_at = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        delay = self.resume_at - monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def release(
+        self,
+        throttled: bool = False,
+        delay: float = 0
+    ) -> None:
+        async with self._condition:
+            self.active -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self.resume_at = max(self.resume_at, monotonic() + delay)
+            elif self.limit < self.max_limit:
+                self.limit += 1
+            self._condition.notify_all()
+
+
+class EmbeddingPipeline:
+    """
+    Embed chunks in batches with a bounded, adaptive number of concurrent
+    requests and upsert each batch while the next ones are being embedded.
+
+    At most ``concurrency`` batches are being embedded and at most
+    ``concurrency`` embedded batches wait for their upsert, so a slow
+    upsert or a rate limit slows down the producer instead of piling up
+    vectors in memory.
+
+    Args:
+        embedding_store (EmbeddingStore): store used to embed the chunks
+        upsert (Callable): blocking function storing ids, chunks and vectors
+        on_progress (Callable): called with the embedded and upserted counts
+    """
+
+    def __init__(
+        self,
+        embedding_store: EmbeddingStore,
+        upsert: Upsert,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        concurrency: int = EMBEDDING_CONCURRENCY,
+        max_retries: int = EMBEDDING_MAX_RETRIES,
+        backoff: float = EMBEDDING_BACKOFF,
+        on_progress: Optional[Callable[[int, int], None]] = None
+    ):
+        self.embedding_store = embedding_store
+        self.upsert = upsert
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.on_progress = on_progress
+        self.embedded = 0
+        self.upserted = 0
+        self.rate_limited = 0
+        self._error: Optional[Exception] = None
+
+    def _progress(self) -> None:
+        if self.on_progress is not None:
+            self.on_progress(self.embedded, self.upserted)
+
+    async def _embed(
+        self,
+        texts: List[str],
+        limiter: AdaptiveLimiter
+    ) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire()
+            try:
+                vectors = await asyncio.to_thread(
+                    self.embedding_store.embed_documents, texts
+                )
+            except Exception as error:
+                if not is_rate_limit(error) or attempt == self.max_retries:
+                    await limiter.release()
+                    raise
+                self.rate_limited += 1
+                delay = self.backoff * 2 ** attempt * (1 + random.random())
+                logging.warning(
+                    f"Embedding rate limited, retrying in {delay:.1f}s"
+                )
+                await limiter.release(throttled=True, delay=delay)
+            else:
+                await limiter.release()
+                return vectors
+
+    async def _embed_batch(
+        self,
+        batch: Batch,
+        limiter: AdaptiveLimiter,
+        slots: asyncio.Semaphore,
+        queue: asyncio.Queue
+    ) -> None:
+        ids, chunks = batch
+        try:
+            vectors = await self._embed(
+                [chunk.page_content for chunk in chunks], limiter
+            )
+            self.embedded += len(ids)
+            self._progress()
+            await queue.put((ids, chunks, vectors))
+        except Exception as error:
+            self._error = self._error or error
+        finally:
+            slots.release()
+
+    async def _upsert_worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                # Keep draining so that no embedding task stays blocked
+                continue
+            try:
+                await asyncio.to_thread(self.upsert, *item)
+            except Exception as error:
+                self._error = error
+                continue
+            self.upserted += len(item[0])
+            self._progress()
+
+    async def run(self, items: Iterable[Tuple[str, Document]]) -> Dict:
+        """
+        Embed and upsert ``(point_id, chunk)`` pairs, consuming ``items``
+        lazily and only as fast as the pipeline drains
+
+        Returns:
+            dict: number of chunks embedded and upserted, rate limits hit
+            and throughput in chunks per second
+        """
+        start = monotonic()
+        limiter = AdaptiveLimiter(self.concurrency)
+        slots = asyncio.Semaphore(self.concurrency)
+        queue = asyncio.Queue(maxsize=self.concurrency)
+        upserts = asyncio.create_task(self._upsert_worker(queue))
+        tasks = []
+        batches = batched(items, self.batch_size)
+        try:
+            while True:
+                # Items may be produced lazily by blocking code
+                batch = await asyncio.to_thread(next, batches, None)
+                if batch is None:
+                    break
+                await slots.acquire()
+                if self._error is not None:
+                    break
+                tasks.append(asyncio.create_task(
+                    self._embed_batch(batch, limiter, slots, queue)
+                ))
+            await asyncio.gather(*tasks)
+            await queue.put(None)
+            await upserts
+        except BaseException:
+            for task in tasks + [upserts]:
+                task.cancel()
+            raise
+        if self._error is not None:
+            raise self._error
+
+        elapsed = monotonic() - start
+        stats = {
+            "embedded": self.embedded,
+            "upserted": self.upserted,
+            "rate_limited": self.rate_limited,
+            "chunks_per_second": round(self.upserted / elapsed, 2)
+            if elapsed > 0 else 0.0,
+        }
+        logging.info(f"Embedding pipeline finished: {stats}")
+        return stats
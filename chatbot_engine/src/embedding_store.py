@@ -0,0 +1,61 @@
+"""Persistent content-addressed store of document embeddings."""
+import hashlib
+from typing import Dict, List
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Embeddings of document texts stored in Redis under the hash of their
+    content, so a text is only sent to the embedding model once no matter
+    the file, position or chunk parameters it comes from.
+
+    Args:
+        redis_client (redis.Redis): sync client used to persist the vectors
+        embeddings (Embeddings): model used for the texts not stored yet
+    """
+
+    def __init__(self, redis_client, embeddings: Embeddings):
+        self.redis_client = redis_client
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", "embeddings")
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text: str) -> str:
+        return f"embedding:{self.model}:{content_hash(text)}"
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Return the embedding of every text, computing only missing ones."""
+        if not texts:
+            return []
+        keys = [self.key(text) for text in texts]
+        records = self.redis_client.mget(keys)
+
+        missing: Dict[str, str] = {}
+        for key, text, record in zip(keys, texts, records):
+            if record is None:
+                missing[key] = text
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        computed = {}
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing, vectors))
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key, vector in computed.items():
+                pipe.set(key, np.asarray(vector, dtype=np.float32).tobytes())
+            pipe.execute()
+
+        return [
+            computed[key] if record is None
+            else np.frombuffer(record, dtype=np.float32).tolist()
+            for key, record in zip(keys, records)
+        ]
@@ -0,0 +1,51 @@
+"""Generation counter of the vectorstore collection."""
+import os
+from time import monotonic
+
+
+VECTORSTORE_GENERATION_KEY = "vectorstore:generation"
+# Seconds a worker trusts its last read of the generation counter
+GENERATION_REFRESH = float(os.getenv("GENERATION_REFRESH", 2))
+
+
+def bump_generation(redis_client) -> int:
+    """
+    Increment the collection generation, invalidating everything cached
+    from the previous content of the vectorstore
+
+    Args:
+        redis_client (redis.Redis): sync client
+
+    Returns:
+        int: the new generation
+    """
+    return redis_client.incr(VECTORSTORE_GENERATION_KEY)
+
+
+def current_generation(redis_client) -> int:
+    """Read the collection generation with a sync client."""
+    return int(redis_client.get(VECTORSTORE_GENERATION_KEY) or 0)
+
+
+class GenerationTracker:
+    """
+    Read the collection generation at most once every ``refresh`` seconds
+
+    Args:
+        redis_client (redis.asyncio.Redis): client used to read the counter
+        refresh (float): seconds between two reads of the counter
+    """
+
+    def __init__(self, redis_client, refresh: float = GENERATION_REFRESH):
+        self.redis_client = redis_client
+        self.refresh = refresh
+        self._generation = 0
+        self._checked_at = None
+
+    async def current(self) -> int:
+        now = monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.refresh:
+            value = await self.redis_client.get(VECTORSTORE_GENERATION_KEY)
+            self._generation = int(value or 0)
+            self._checked_at = now
+        return self._generation
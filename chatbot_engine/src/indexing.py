@@ -0,0 +1,199 @@
+"""Incremental, content-addressed indexing of the vectorstore."""
+import asyncio
+import os
+from typing import (
+    Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+)
+
+from langchain.schema import Document
+from qdrant_client import QdrantClient
+from qdrant_client.http import models as rest
+
+from .embedding_pipeline import EmbeddingPipeline
+from .embedding_store import EmbeddingStore
+from .splitting import iter_split
+
+
+COLLECTION_NAME = "myvectorstore"
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 2000))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 200))
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", 256))
+
+
+class VectorstoreIndexer:
+    """
+    Keep the Qdrant collection in sync with a set of documents.
+
+    Chunks are addressed by the hash of their source and content. Only the
+    chunks missing from the collection are embedded and upserted, through
+    an ``EmbeddingPipeline``, and the points whose chunk no longer exists
+    are deleted, so the cost of a rebuild depends on the size of the
+    change, not of the corpus.
+
+    Args:
+        client (QdrantClient): client of the Qdrant server
+        embedding_store (EmbeddingStore): persistent store of embeddings
+        collection_name (str): name of the collection to keep in sync
+    """
+
+    def __init__(
+        self,
+        client: QdrantClient,
+        embedding_store: EmbeddingStore,
+        collection_name: str = COLLECTION_NAME,
+        chunk_size: int = CHUNK_SIZE,
+        chunk_overlap: int = CHUNK_OVERLAP
+    ):
+        self.client = client
+        self.embedding_store = embedding_store
+        self.collection_name = collection_name
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    @property
+    def chunking(self) -> str:
+        """Chunk parameters, documents split with others are split again."""
+        return f"{self.chunk_size}:{self.chunk_overlap}"
+
+    def existing_points(self) -> Dict[str, str]:
+        """Map the id of every point of the collection to its source."""
+        if not self.client.collection_exists(self.collection_name):
+            return {}
+        points, offset = {}, None
+        while True:
+            records, offset = self.client.scroll(
+                self.collection_name,
+                limit=1000,
+                offset=offset,
+                with_payload=["metadata"],
+                with_vectors=False,
+            )
+            for record in records:
+                metadata = (record.payload or {}).get("metadata") or {}
+                points[str(record.id)] = metadata.get("source")
+            if offset is None:
+                return points
+
+    def _ensure_collection(self, vector_size: int) -> None:
+        if not self.client.collection_exists(self.collection_name):
+            self.client.create_collection(
+                self.collection_name,
+                vectors_config=rest.VectorParams(
+                    size=vector_size, distance=rest.Distance.COSINE
+                ),
+            )
+
+    def upsert(
+        self,
+        ids: List[str],
+        chunks: List[Document],
+        vectors: List[List[float]]
+    ) -> None:
+        """Upsert embedded chunks under the given point ids."""
+        if not vectors:
+            return
+        self._ensure_collection(len(vectors[0]))
+        for start in range(0, len(ids), UPSERT_BATCH_SIZE):
+            end = start + UPSERT_BATCH_SIZE
+            self.client.upsert(
+                self.collection_name,
+                points=[
+                    rest.PointStruct(
+                        id=point_id,
+                        vector=vector,
+                        payload={
+                            "page_content": chunk.page_content,
+                            "metadata": chunk.metadata,
+                        },
+                    )
+                    for point_id, chunk, vector in zip(
+                        ids[start:end], chunks[start:end], vectors[start:end]
+                    )
+                ],
+            )
+
+    def delete(self, ids: List[str]) -> None:
+        for start in range(0, len(ids), UPSERT_BATCH_SIZE):
+            self.client.delete(
+                self.collection_name,
+                points_selector=rest.PointIdsList(
+                    points=ids[start:start + UPSERT_BATCH_SIZE]
+                ),
+            )
+
+    def _new_chunks(
+        self,
+        documents: Iterable[Document],
+        existing: Dict[str, str],
+        seen: Set[str],
+        on_document: Optional[Callable[[int], None]] = None,
+        on_chunk: Optional[Callable[[int], None]] = None
+    ) -> Iterator[Tuple[str, Document]]:
+        """Split documents in order, yielding the chunks to upsert."""
+        new_chunks = 0
+        split = iter_split(documents, self.chunk_size, self.chunk_overlap)
+        for loaded, chunks in enumerate(split, 1):
+            for point_id, chunk in chunks:
+                if point_id in seen:
+                    continue
+                seen.add(point_id)
+                if point_id not in existing:
+                    new_chunks += 1
+                    if on_chunk is not None:
+                        on_chunk(new_chunks)
+                    yield point_id, chunk
+            if on_document is not None:
+                on_document(loaded)
+
+    async def aindex(
+        self,
+        documents: Iterable[Document],
+        keep_sources: Set[str] = frozenset(),
+        existing: Optional[Dict[str, str]] = None,
+        on_document: Optional[Callable[[int], None]] = None,
+        on_chunk: Optional[Callable[[int], None]] = None,
+        on_progress: Optional[Callable[[int, int], None]] = None
+    ) -> Dict:
+        """
+        Make the collection contain exactly the chunks of ``documents``,
+        plus the points of ``keep_sources``, which are left untouched
+
+        Documents are consumed as a stream: each one is split and its new
+        chunks are embedded and upserted while the next ones are loaded.
+        Removed points are deleted once the stream is exhausted.
+
+        Args:
+            documents (Iterable[Document]): new or changed documents
+            keep_sources (set): sources of the unchanged documents
+            existing (dict): result of ``existing_points``, if known
+            on_document (Callable): called with the documents loaded so far
+            on_chunk (Callable): called with the new chunks found so far
+            on_progress (Callable): see ``EmbeddingPipeline``
+
+        Returns:
+            dict: number of chunks added, removed and left unchanged, and
+            the statistics of the embedding pipeline
+        """
+        if existing is None:
+            existing = await asyncio.to_thread(self.existing_points)
+
+        seen = {
+            point_id for point_id, source in existing.items()
+            if source in keep_sources
+        }
+        pipeline = EmbeddingPipeline(
+            self.embedding_store, self.upsert, on_progress=on_progress
+        )
+        stats = await pipeline.run(self._new_chunks(
+            documents, existing, seen, on_document, on_chunk
+        ))
+
+        removed = [point_id for point_id in existing if point_id not in seen]
+        await asyncio.to_thread(self.delete, removed)
+
+        return {
+            "added": stats["upserted"],
+            "removed": len(removed),
+            "unchanged": len(seen) - stats["upserted"],
+            **stats,
+        }
@@ -0,0 +1,188 @@
+"""Background ingestion jobs tracked in Redis."""
+import asyncio
+import os
+import uuid
+from time import time
+from typing import Dict, Optional
+
+
+INGESTION_LOCK_KEY = "ingestion:lock"
+# Seconds the lock survives a worker that stopped refreshing it
+INGESTION_LOCK_TTL = int(os.getenv("INGESTION_LOCK_TTL", 60))
+# Seconds a finished job status is kept
+INGESTION_JOB_TTL = int(os.getenv("INGESTION_JOB_TTL", 24 * 3600))
+# Seconds between two writes of the progress of a running job
+INGESTION_REPORT_INTERVAL = float(os.getenv("INGESTION_REPORT_INTERVAL", 1))
+
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# Only touch the lock while it still belongs to the job
+_REFRESH_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _parse(value: str):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+class IngestionJob:
+    """
+    A vectorstore ingestion running in the background of a worker.
+
+    Creating a job takes a Redis lock, so only one worker at a time can
+    rebuild the collection. While the job runs, its progress is written to
+    Redis every ``INGESTION_REPORT_INTERVAL`` seconds and the lock is
+    refreshed, a crashed worker releases it after ``INGESTION_LOCK_TTL``.
+
+    Args:
+        redis_client (redis.asyncio.Redis): client used to track the job
+        job_id (str): identifier of the job
+    """
+
+    def __init__(self, redis_client, job_id: str):
+        self.redis_client = redis_client
+        self.job_id = job_id
+        self.started_at = time()
+        self.documents_total = 0
+        self.documents_loaded = 0
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        self.chunks_upserted = 0
+        self.result: Dict = {}
+        self._reporter: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def key(job_id: str) -> str:
+        return f"ingestion_job:{job_id}"
+
+    @classmethod
+    async def create(cls, redis_client) -> Optional["IngestionJob"]:
+        """Return a new job, or None if another one holds the lock."""
+        job = cls(redis_client, uuid.uuid4().hex)
+        acquired = await redis_client.set(
+            INGESTION_LOCK_KEY, job.job_id, nx=True, ex=INGESTION_LOCK_TTL
+        )
+        if not acquired:
+            return None
+        await job._write(status=RUNNING)
+        return job
+
+    @staticmethod
+    async def running_id(redis_client) -> Optional[str]:
+        job_id = await redis_client.get(INGESTION_LOCK_KEY)
+        return job_id.decode() if job_id else None
+
+    @classmethod
+    async def load(cls, redis_client, job_id: str) -> Optional[Dict]:
+        """
+        Return the status of a job, with its ETA while it runs. A running
+        job whose worker died, letting the lock expire, is reported failed.
+        """
+        # Read both at once, a job finishing in between is not a dead one
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.hgetall(cls.key(job_id))
+        pipe.get(INGESTION_LOCK_KEY)
+        fields, lock = await pipe.execute()
+        if not fields:
+            return None
+        status = {
+            key.decode(): value.decode() for key, value in fields.items()
+        }
+        for name, value in status.items():
+            if name not in ("job_id", "status", "error"):
+                status[name] = _parse(value)
+        if status["status"] == RUNNING and (
+            lock is None or lock.decode() != job_id
+        ):
+            status["status"] = FAILED
+            status["error"] = "The worker running the job stopped"
+
+        # Documents are streamed, the number of chunks still to come is
+        # extrapolated from the chunks of the documents loaded so far
+        status["eta_seconds"] = None
+        loaded = status["documents_loaded"]
+        done = status["chunks_upserted"]
+        if status["status"] == RUNNING and loaded and done:
+            expected = status["chunks_total"] * status["documents_total"] \
+                / loaded
+            if done < expected:
+                elapsed = time() - status["started_at"]
+                status["eta_seconds"] = round(
+                    elapsed / done * (expected - done), 1
+                )
+        return status
+
+    def set_documents_total(self, documents_total: int) -> None:
+        self.documents_total = documents_total
+
+    def track_documents(self, documents_loaded: int) -> None:
+        self.documents_loaded = documents_loaded
+
+    def track_chunks(self, chunks_total: int) -> None:
+        self.chunks_total = chunks_total
+
+    def track(self, chunks_embedded: int, chunks_upserted: int) -> None:
+        self.chunks_embedded = chunks_embedded
+        self.chunks_upserted = chunks_upserted
+
+    async def _write(self, **fields) -> None:
+        key = self.key(self.job_id)
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.hset(key, mapping={
+            "job_id": self.job_id,
+            "started_at": self.started_at,
+            "documents_total": self.documents_total,
+            "documents_loaded": self.documents_loaded,
+            "chunks_total": self.chunks_total,
+            "chunks_embedded": self.chunks_embedded,
+            "chunks_upserted": self.chunks_upserted,
+            **fields,
+        })
+        pipe.expire(key, INGESTION_JOB_TTL)
+        await pipe.execute()
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(INGESTION_REPORT_INTERVAL)
+            await self._write()
+            await self.redis_client.eval(
+                _REFRESH_LOCK, 1, INGESTION_LOCK_KEY,
+                self.job_id, INGESTION_LOCK_TTL
+            )
+
+    async def __aenter__(self) -> "IngestionJob":
+        self._reporter = asyncio.create_task(self._report())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self._reporter.cancel()
+        try:
+            if exc is None:
+                await self._write(
+                    status=SUCCEEDED, finished_at=time(), **self.result
+                )
+            else:
+                await self._write(
+                    status=FAILED, error=str(exc), finished_at=time()
+                )
+        finally:
+            await self.redis_client.eval(
+                _RELEASE_LOCK, 1, INGESTION_LOCK_KEY, self.job_id
+            )
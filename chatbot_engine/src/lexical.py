@@ -0,0 +1,279 @@
+"""BM25 index of the vectorstore chunks and hybrid rank fusion."""
+import asyncio
+import math
+import os
+import re
+import zlib
+from collections import Counter, defaultdict
+from time import monotonic
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import msgpack
+import numpy as np
+from langchain.schema import Document
+from qdrant_client import QdrantClient
+
+from .generation import GenerationTracker
+
+
+HYBRID_RETRIEVAL = os.getenv(
+    "HYBRID_RETRIEVAL", "true"
+).lower() in ("1", "true", "yes")
+# Results of each retriever fused into the final ranking
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 20))
+# Damping constant of reciprocal rank fusion
+RRF_K = int(os.getenv("RRF_K", 60))
+# Longest query, in terms, answered from the lexical index alone
+EXACT_MATCH_MAX_TERMS = int(os.getenv("EXACT_MATCH_MAX_TERMS", 4))
+# Seconds a superseded lexical index is kept for the workers that did not
+# see the new generation yet
+LEXICAL_INDEX_GRACE = int(os.getenv("LEXICAL_INDEX_GRACE", 60))
+# Seconds between two attempts to load a missing lexical index
+LEXICAL_INDEX_RETRY = float(os.getenv("LEXICAL_INDEX_RETRY", 30))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Words, and codes joining them with dots, dashes or slashes
+_TOKEN = re.compile(r"\w+(?:[.\-/]\w+)*")
+# Double quoted phrases, single quotes are apostrophes more often than not
+_QUOTED = re.compile(r"\"[^\"]+\"|\u201c[^\u201d]+\u201d")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase terms of a text, codes are indexed whole and by part."""
+    terms = []
+    for token in _TOKEN.findall(text.lower()):
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(re.findall(r"\w+", token))
+    return terms
+
+
+def _is_code(token: str) -> bool:
+    return any(c.isalpha() for c in token) and any(c.isdigit() for c in token)
+
+
+def is_exact_match(query: str) -> bool:
+    """
+    Whether a query looks for an exact string, a quoted phrase within a
+    longer query or a short query with a product code or price item, e.g.
+    ``ml.g5.xlarge price``. Quotes wrapping the whole query, as the LLM
+    often writes the condensed question, do not make it exact.
+    """
+    query = query.strip()
+    if _QUOTED.fullmatch(query):
+        query = query[1:-1]
+    elif _QUOTED.search(query) and _TOKEN.search(_QUOTED.sub(" ", query)):
+        return True
+    tokens = _TOKEN.findall(query.lower())
+    return 0 < len(tokens) <= EXACT_MATCH_MAX_TERMS \
+        and any(_is_code(token) for token in tokens)
+
+
+def lexical_index_key(generation: int) -> str:
+    return f"lexical_index:{generation}"
+
+
+def document_key(doc: Document) -> Tuple[Optional[str], str]:
+    return doc.metadata.get("source"), doc.page_content
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[List[Document]],
+    k: int,
+    rrf_k: int = RRF_K
+) -> List[Document]:
+    """Fuse ranked lists of documents, scoring each 1 / (rrf_k + rank)."""
+    scores, docs = defaultdict(float), {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, 1):
+            key = document_key(doc)
+            scores[key] += 1 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[key] for key in best]
+
+
+class BM25Index:
+    """
+    Okapi BM25 index over the chunks of the collection, with posting lists
+    stored as NumPy arrays and serialized as compressed msgpack.
+
+    Args:
+        documents (list): indexed chunks
+        postings (dict): term to (chunk positions, term frequencies)
+        lengths (np.ndarray): number of terms of every chunk
+    """
+
+    def __init__(
+        self,
+        documents: List[Document],
+        postings: Dict[str, Tuple[np.ndarray, np.ndarray]],
+        lengths: np.ndarray
+    ):
+        self.documents = documents
+        self.postings = postings
+        self.lengths = lengths
+        n = len(documents)
+        average = float(lengths.mean()) if n else 0.0
+        # Per-chunk part of the BM25 denominator
+        self._norms = BM25_K1 * (
+            1 - BM25_B + BM25_B * lengths / max(average, 1e-9)
+        )
+        self._idf = {
+            term: math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            for term, (ids, _) in postings.items()
+        }
+
+    @classmethod
+    def build(cls, documents: List[Document]) -> "BM25Index":
+        postings = defaultdict(lambda: ([], []))
+        lengths = []
+        for position, doc in enumerate(documents):
+            counts = Counter(tokenize(doc.page_content))
+            lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                ids, tfs = postings[term]
+                ids.append(position)
+                tfs.append(count)
+        return cls(
+            documents,
+            {
+                term: (
+                    np.asarray(ids, dtype=np.uint32),
+                    np.asarray(tfs, dtype=np.uint16),
+                )
+                for term, (ids, tfs) in postings.items()
+            },
+            np.asarray(lengths, dtype=np.float32),
+        )
+
+    @classmethod
+    def from_collection(
+        cls,
+        client: QdrantClient,
+        collection_name: str
+    ) -> "BM25Index":
+        """
+        Index the ``page_content`` payload of every point, the point id is
+        kept as the ``_id`` metadata, like langchain does.
+        """
+        documents, offset = [], None
+        if not client.collection_exists(collection_name):
+            return cls.build([])
+        while True:
+            records, offset = client.scroll(
+                collection_name,
+                limit=1000,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False,
+            )
+            for record in records:
+                payload = record.payload or {}
+                documents.append(Document(
+                    page_content=payload.get("page_content", ""),
+                    metadata={
+                        **(payload.get("metadata") or {}),
+                        "_id": str(record.id),
+                    },
+                ))
+            if offset is None:
+                return cls.build(documents)
+
+    def dumps(self) -> bytes:
+        return zlib.compress(msgpack.packb([
+            [[doc.page_content, doc.metadata] for doc in self.documents],
+            {
+                term: [ids.tobytes(), tfs.tobytes()]
+                for term, (ids, tfs) in self.postings.items()
+            },
+            self.lengths.tobytes(),
+        ]))
+
+    @classmethod
+    def loads(cls, data: bytes) -> "BM25Index":
+        records, postings, lengths = msgpack.unpackb(zlib.decompress(data))
+        return cls(
+            [
+                Document(page_content=content, metadata=metadata)
+                for content, metadata in records
+            ],
+            {
+                term: (
+                    np.frombuffer(ids, dtype=np.uint32),
+                    np.frombuffer(tfs, dtype=np.uint16),
+                )
+                for term, (ids, tfs) in postings.items()
+            },
+            np.frombuffer(lengths, dtype=np.float32),
+        )
+
+    def search(self, query: str, k: int = 4) -> List[Document]:
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            ids, tfs = self.postings[term]
+            tfs = tfs.astype(np.float32)
+            scores[ids] += self._idf[term] * tfs * (BM25_K1 + 1) \
+                / (tfs + self._norms[ids])
+        matches = np.flatnonzero(scores)
+        best = matches[np.argsort(-scores[matches], kind="stable")][:k]
+        return [self.documents[i] for i in best]
+
+
+def save_lexical_index(redis_client, index: BM25Index, generation: int):
+    """Store the index of a generation, it does not expire while live."""
+    redis_client.set(lexical_index_key(generation), index.dumps())
+
+
+def retire_lexical_index(redis_client, generation: int):
+    """Expire the index of a generation once it has been superseded."""
+    redis_client.expire(lexical_index_key(generation), LEXICAL_INDEX_GRACE)
+
+
+class LexicalSearch:
+    """
+    BM25 search over the lexical index of the current collection
+    generation, loaded from Redis once per generation.
+
+    Args:
+        redis_client (redis.asyncio.Redis): client used to load the index
+        generations (GenerationTracker): source of the collection generation
+    """
+
+    def __init__(self, redis_client, generations: GenerationTracker):
+        self.redis_client = redis_client
+        self.generations = generations
+        self._generation = None
+        self._index: Optional[BM25Index] = None
+        self._retry_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def index(self) -> Optional[BM25Index]:
+        """Index of the current generation, None until it is built."""
+        generation = await self.generations.current()
+        if generation == self._generation:
+            return self._index
+        if self._index is None and monotonic() < self._retry_at:
+            return None
+        async with self._lock:
+            if generation != self._generation:
+                data = await self.redis_client.get(
+                    lexical_index_key(generation)
+                )
+                if data is None:
+                    self._index = None
+                    self._retry_at = monotonic() + LEXICAL_INDEX_RETRY
+                else:
+                    self._index = await asyncio.to_thread(
+                        BM25Index.loads, data
+                    )
+                    self._generation = generation
+        return self._index
+
+    async def search(self, query: str, k: int = 4) -> List[Document]:
+        index = await self.index()
+        return index.search(query, k) if index is not None else []
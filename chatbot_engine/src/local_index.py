@@ -0,0 +1,376 @@
+"""In-process replica of the vectorstore collection."""
+import asyncio
+import logging
+import os
+import uuid
+from typing import (
+    Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+)
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from langchain.schema import Document
+from langchain.vectorstores.base import VectorStore
+from qdrant_client import QdrantClient
+
+from .generation import GenerationTracker
+
+
+LOCAL_VECTOR_INDEX = os.getenv(
+    "LOCAL_VECTOR_INDEX", "false"
+).lower() in ("1", "true", "yes")
+# Number of vectors from which searches go through the IVF index
+LOCAL_INDEX_ANN_THRESHOLD = int(os.getenv("LOCAL_INDEX_ANN_THRESHOLD", 20000))
+# Number of IVF lists searched per query
+LOCAL_INDEX_PROBES = int(os.getenv("LOCAL_INDEX_PROBES", 8))
+# Iterations of the k-means training the IVF centroids
+LOCAL_INDEX_KMEANS_ITERATIONS = 10
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the ``k`` highest scores, best first."""
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class IVFIndex:
+    """
+    Inverted file index over normalized vectors: a spherical k-means
+    splits the vectors into lists, and a query only scores the vectors of
+    the ``probes`` lists with the closest centroids.
+
+    Args:
+        matrix (np.ndarray): normalized vectors, one per row
+        probes (int): number of lists searched per query
+        seed (int): seed of the k-means initialization
+    """
+
+    def __init__(
+        self,
+        matrix: np.ndarray,
+        probes: int = LOCAL_INDEX_PROBES,
+        seed: int = 0
+    ):
+        self.matrix = matrix
+        self.probes = probes
+        n_lists = max(1, int(np.sqrt(len(matrix))))
+        rng = np.random.default_rng(seed)
+
+        # Centroids are trained on a sample, then every vector is assigned
+        sample = matrix[rng.choice(
+            len(matrix), min(len(matrix), 64 * n_lists), replace=False
+        )]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(LOCAL_INDEX_KMEANS_ITERATIONS):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for i in range(n_lists):
+                members = sample[assignment == i]
+                if len(members):
+                    centroids[i] = members.sum(axis=0)
+            centroids = _normalize(centroids)
+
+        self.centroids = centroids
+        assignment = np.argmax(matrix @ centroids.T, axis=1)
+        self.lists = [np.flatnonzero(assignment == i) for i in range(n_lists)]
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, ...]:
+        closest = _top_k(self.centroids @ query, self.probes)
+        candidates = np.concatenate([self.lists[i] for i in closest])
+        scores = self.matrix[candidates] @ query
+        best = _top_k(scores, k)
+        return candidates[best], scores[best]
+
+
+class Snapshot(NamedTuple):
+    ids: List[str]
+    documents: List[Document]
+    matrix: Optional[np.ndarray]
+    ivf: Optional[IVFIndex]
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Read replica of a Qdrant collection held in memory, searched with a
+    matrix-vector product, or through an ``IVFIndex`` once the collection
+    holds ``ann_threshold`` vectors.
+
+    The snapshot of the vectors and payloads is reloaded whenever the
+    collection generation changes. Without a client, the store is a
+    standalone in-memory index filled with ``add_texts``, which can stand
+    in for Qdrant to run the engine offline.
+
+    Args:
+        embedding (Embeddings): model embedding the queries
+        client (QdrantClient): client of the replicated collection, if any
+        collection_name (str): name of the replicated collection
+        generations (GenerationTracker): source of the collection generation
+        ann_threshold (int): number of vectors from which IVF is used
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        client: Optional[QdrantClient] = None,
+        collection_name: str = "myvectorstore",
+        generations: Optional[GenerationTracker] = None,
+        ann_threshold: int = LOCAL_INDEX_ANN_THRESHOLD,
+        content_payload_key: str = "page_content",
+        metadata_payload_key: str = "metadata"
+    ):
+        self.embedding = embedding
+        self.client = client
+        self.collection_name = collection_name
+        self.generations = generations
+        self.ann_threshold = ann_threshold
+        self.content_payload_key = content_payload_key
+        self.metadata_payload_key = metadata_payload_key
+        # Swapped as a whole, so searches never see a partial reload
+        self.snapshot = Snapshot([], [], None, None)
+        self._generation = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def __len__(self) -> int:
+        return len(self.snapshot.documents)
+
+    def _build(
+        self,
+        ids: List[str],
+        documents: List[Document],
+        vectors: List[List[float]]
+    ) -> Snapshot:
+        matrix = _normalize(np.asarray(vectors, dtype=np.float32)) \
+            if vectors else None
+        ivf = IVFIndex(matrix) if len(vectors) >= self.ann_threshold else None
+        return Snapshot(ids, documents, matrix, ivf)
+
+    def load(self) -> None:
+        """Replace the snapshot with the content of the collection."""
+        ids, documents, vectors = [], [], []
+        if self.client.collection_exists(self.collection_name):
+            offset = None
+            while True:
+                records, offset = self.client.scroll(
+                    self.collection_name,
+                    limit=1000,
+                    offset=offset,
+                    with_payload=True,
+                    with_vectors=True,
+                )
+                for record in records:
+                    payload = record.payload or {}
+                    metadata = payload.get(self.metadata_payload_key)
+                    ids.append(str(record.id))
+                    documents.append(Document(
+                        page_content=payload.get(self.content_payload_key, ""),
+                        metadata=metadata or {},
+                    ))
+                    vectors.append(record.vector)
+                if offset is None:
+                    break
+        self.snapshot = self._build(ids, documents, vectors)
+        logging.info(
+            f"Loaded {len(ids)} points of {self.collection_name} in memory"
+        )
+
+    async def sync(self) -> None:
+        """Reload the snapshot if the collection generation changed."""
+        if self.client is None:
+            return
+        generation = await self.generations.current() \
+            if self.generations is not None else 0
+        if generation == self._generation:
+            return
+        async with self._lock:
+            if generation != self._generation:
+                await asyncio.to_thread(self.load)
+                self._generation = generation
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any
+    ) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = self.embedding.embed_documents(texts)
+        snapshot = self.snapshot
+        previous = [] if snapshot.matrix is None else list(snapshot.matrix)
+        self.snapshot = self._build(
+            snapshot.ids + ids,
+            snapshot.documents + [
+                Document(page_content=text, metadata=metadata)
+                for text, metadata in zip(texts, metadatas)
+            ],
+            previous + list(vectors),
+        )
+        return ids
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any
+    ) -> "LocalVectorStore":
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas)
+        return store
+
+    def _search(
+        self,
+        embedding: List[float],
+        k: int
+    ) -> Tuple[Snapshot, np.ndarray, np.ndarray]:
+        if self.client is not None and self._generation is None:
+            self.load()
+            self._generation = 0
+        snapshot = self.snapshot
+        if snapshot.matrix is None:
+            return snapshot, np.empty(0, np.int64), np.empty(0, np.float32)
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        if snapshot.ivf is not None:
+            indices, scores = snapshot.ivf.search(query, k)
+        else:
+            scores = snapshot.matrix @ query
+            indices = _top_k(scores, k)
+            scores = scores[indices]
+        return snapshot, indices, scores
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        snapshot, indices, scores = self._search(embedding, k)
+        return [
+            (snapshot.documents[i], float(score))
+            for i, score in zip(indices, scores)
+        ]
+
+    def similarity_search_with_vectors_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4
+    ) -> List[Tuple[Document, float, np.ndarray]]:
+        """Like ``similarity_search_with_score_by_vector``, with vectors."""
+        snapshot, indices, scores = self._search(embedding, k)
+        return [
+            (snapshot.documents[i], float(score), snapshot.matrix[i])
+            for i, score in zip(indices, scores)
+        ]
+
+    def vectors_by_id(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        snapshot = self.snapshot
+        wanted = set(ids)
+        return {
+            point_id: snapshot.matrix[i]
+            for i, point_id in enumerate(snapshot.ids) if point_id in wanted
+        }
+
+    def similarity_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        **kwargs: Any
+    ) -> List[Document]:
+        return [
+            doc for doc, _ in self.similarity_search_with_score_by_vector(
+                embedding, k, **kwargs
+            )
+        ]
+
+    def similarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(
+            self.embedding.embed_query(query), k, **kwargs
+        )
+
+    def similarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        **kwargs: Any
+    ) -> List[Document]:
+        return [
+            doc for doc, _ in self.similarity_search_with_score(
+                query, k, **kwargs
+            )
+        ]
+
+    async def asimilarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        await self.sync()
+        return self.similarity_search_with_score_by_vector(
+            embedding, k, **kwargs
+        )
+
+    async def asimilarity_search_with_vectors_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4
+    ) -> List[Tuple[Document, float, np.ndarray]]:
+        await self.sync()
+        return self.similarity_search_with_vectors_by_vector(embedding, k)
+
+    async def asimilarity_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        **kwargs: Any
+    ) -> List[Document]:
+        docs_and_scores = await self.asimilarity_search_with_score_by_vector(
+            embedding, k, **kwargs
+        )
+        return [doc for doc, _ in docs_and_scores]
+
+    async def asimilarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        embedding = await self.embedding.aembed_query(query)
+        return await self.asimilarity_search_with_score_by_vector(
+            embedding, k, **kwargs
+        )
+
+    async def asimilarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        **kwargs: Any
+    ) -> List[Document]:
+        return [
+            doc for doc, _ in await self.asimilarity_search_with_score(
+                query, k, **kwargs
+            )
+        ]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # Cosine similarities, as returned by Qdrant
+        return lambda score: score
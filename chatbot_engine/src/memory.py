@@ -0,0 +1,67 @@
+"""Conversation memory stored as native Redis lists."""
+import hashlib
+import os
+from typing import List
+
+from .turns import Turn, decode_turn, encode_turn
+
+
+MEMORY_KEY_PREFIX = "memory:"
+# Seconds a conversation is remembered after its last turn
+MEMORY_WINDOW = int(os.getenv("MEMORY_WINDOW", 120))
+# Number of turns (human and assistant messages) kept per conversation
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", 4))
+# Condensed questions kept by each in-process cache
+CONDENSE_CACHE_SIZE = int(os.getenv("CONDENSE_CACHE_SIZE", 1024))
+
+
+def condense_key(history: str, question: str) -> str:
+    """Cache key of the condensation of a question given its history."""
+    return hashlib.sha1(f"{history}\0{question}".encode()).hexdigest()
+
+
+class ConversationMemory:
+    """
+    Append-only conversation memory backed by one Redis list per user.
+
+    Each turn is encoded with ``encode_turn`` and pushed to the tail of the
+    list, the list is trimmed to the last ``max_turns`` turns and the key
+    expiration is refreshed, all in a single pipelined round trip.
+    Conversations idle for more than ``window`` seconds are expired by
+    Redis itself.
+
+    Args:
+        redis_client (redis.asyncio.Redis): client used to store the lists
+        window (int): seconds to keep a conversation after its last turn
+        max_turns (int): maximum number of turns kept per conversation
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        window: int = MEMORY_WINDOW,
+        max_turns: int = MEMORY_MAX_TURNS
+    ):
+        self.redis_client = redis_client
+        self.window = window
+        self.max_turns = max_turns
+
+    @staticmethod
+    def key(user_id: str) -> str:
+        return f"{MEMORY_KEY_PREFIX}{user_id}"
+
+    async def load(self, user_id: str) -> List[Turn]:
+        """Return the remembered turns of a user, oldest first."""
+        records = await self.redis_client.lrange(
+            self.key(user_id), -self.max_turns, -1
+        )
+        return [decode_turn(record) for record in records]
+
+    async def append(self, user_id: str, *turns: Turn) -> None:
+        """Append turns to the conversation of a user."""
+        key = self.key(user_id)
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.rpush(key, *[encode_turn(turn) for turn in turns])
+        pipe.ltrim(key, -self.max_turns, -1)
+        pipe.expire(key, self.window)
+        await pipe.execute()
@@ -0,0 +1,226 @@
+"""Cached query embedding and document retrieval."""
+import asyncio
+import hashlib
+import os
+from collections import Counter
+from typing import Awaitable, Dict, List, Optional, Tuple
+
+from langchain.schema import Document
+from langchain.vectorstores.base import VectorStore
+
+from lib.context_selection import (
+    ContextSelection, afetch_vectors, asearch_with_vectors, select_context
+)
+from lib.speculative import speculative_search
+
+from .cache import TwoLevelCache
+from .generation import GenerationTracker
+from .lexical import (
+    HYBRID_CANDIDATES, LexicalSearch, document_key, is_exact_match,
+    reciprocal_rank_fusion
+)
+
+
+# Seconds a cached query lives in Redis
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", 24 * 3600))
+# Entries of each in-process query cache
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 2048))
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def query_key(query: str) -> str:
+    return hashlib.sha1(normalize_query(query).encode()).hexdigest()
+
+
+class CachedRetrieval:
+    """
+    Similarity search with a two-level cache of query embeddings and
+    retrieved documents, keyed by the normalized query text.
+
+    Query embeddings only depend on the embedding model, so they survive
+    vectorstore rebuilds. Document lists are keyed by the collection
+    generation and are invalidated when ``create_vectorstore`` bumps it.
+
+    With a lexical index, vector and BM25 searches run concurrently and
+    are fused by reciprocal rank. Exact-match queries (codes, quoted
+    strings) answered by the lexical index skip the embedding entirely.
+
+    Given a ``ContextSelection``, more candidates are retrieved and the
+    context is picked by ``select_context``, from the candidate embeddings
+    returned by the vector search. Lexical candidates missing from it are
+    fetched from the collection by point id.
+
+    Args:
+        vectorstore (VectorStore): A vector store used for document retrieval.
+        redis_client (redis.asyncio.Redis): client of the shared cache level
+        generations (GenerationTracker): source of the collection generation
+        lexical (LexicalSearch): BM25 search fused with the vector search
+    """
+
+    def __init__(
+        self,
+        vectorstore: VectorStore,
+        redis_client,
+        generations: GenerationTracker,
+        maxsize: int = QUERY_CACHE_SIZE,
+        ttl: int = QUERY_CACHE_TTL,
+        lexical: Optional[LexicalSearch] = None
+    ):
+        self.vectorstore = vectorstore
+        self.generations = generations
+        self.lexical = lexical
+        model = getattr(vectorstore.embeddings, "model", "embeddings")
+        self.embedding_cache = TwoLevelCache(
+            redis_client, f"query_embedding:{model}", maxsize, ttl
+        )
+        self.documents_cache = TwoLevelCache(
+            redis_client, "query_documents", maxsize, ttl
+        )
+        self.speculations = Counter()
+        self.exact_matches = 0
+
+    async def aembed_query(self, query: str) -> List[float]:
+        key = query_key(query)
+        embedding = await self.embedding_cache.get(key)
+        if embedding is None:
+            embedding = await self.vectorstore.embeddings.aembed_query(query)
+            await self.embedding_cache.set(key, embedding)
+        return embedding
+
+    async def asimilarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        selection: Optional[ContextSelection] = None
+    ) -> List[Document]:
+        """
+        Documents of a query, ``selection`` replaces ``k`` when given.
+        """
+        generation = await self.generations.current()
+        mode = "vector" if self.lexical is None else "hybrid"
+        size = k if selection is None else "-".join(map(str, selection))
+        key = f"{generation}:{size}:{mode}:{query_key(query)}"
+        records = await self.documents_cache.get(key)
+        if records is not None:
+            return [
+                Document(page_content=content, metadata=metadata)
+                for content, metadata in records
+            ]
+
+        if selection is None:
+            docs = await self._search(query, k)
+        else:
+            docs = await self._select(query, selection)
+        await self.documents_cache.set(
+            key, [[doc.page_content, doc.metadata] for doc in docs]
+        )
+        return docs
+
+    async def _vector_search(self, query: str, k: int) -> List[Document]:
+        embedding = await self.aembed_query(query)
+        return await self.vectorstore.asimilarity_search_by_vector(
+            embedding, k=k
+        )
+
+    async def _search(self, query: str, k: int) -> List[Document]:
+        if self.lexical is None:
+            return await self._vector_search(query, k)
+        if is_exact_match(query):
+            docs = await self.lexical.search(query, k)
+            if docs:
+                self.exact_matches += 1
+                return docs
+
+        candidates = max(k, HYBRID_CANDIDATES)
+        lexical, vector = await asyncio.gather(
+            self.lexical.search(query, candidates),
+            self._vector_search(query, candidates),
+        )
+        return reciprocal_rank_fusion([vector, lexical], k)
+
+    async def _select(
+        self,
+        query: str,
+        selection: ContextSelection
+    ) -> List[Document]:
+        if self.lexical is not None and is_exact_match(query):
+            return await self._search(query, selection.k)
+
+        embedding = await self.aembed_query(query)
+        if self.lexical is None:
+            candidates = await asearch_with_vectors(
+                self.vectorstore, embedding, selection.fetch_k
+            )
+            docs = [doc for doc, _, _ in candidates]
+            vectors = [vector for _, _, vector in candidates]
+        else:
+            docs, vectors = await self._hybrid_candidates(
+                query, embedding, selection.fetch_k
+            )
+        if len(docs) <= 1:
+            return docs
+        return [
+            docs[i] for i in select_context(embedding, vectors, selection)
+        ]
+
+    async def _hybrid_candidates(
+        self,
+        query: str,
+        embedding: List[float],
+        k: int
+    ) -> Tuple[List[Document], List[List[float]]]:
+        """Fused candidates with their embeddings, unknown ones dropped."""
+        candidates, lexical = await asyncio.gather(
+            asearch_with_vectors(self.vectorstore, embedding, k),
+            self.lexical.search(query, k),
+        )
+        known = {
+            document_key(doc): vector for doc, _, vector in candidates
+        }
+        docs = reciprocal_rank_fusion(
+            [[doc for doc, _, _ in candidates], lexical], k
+        )
+        missing = [
+            doc.metadata["_id"] for doc in docs
+            if document_key(doc) not in known and "_id" in doc.metadata
+        ]
+        fetched = await afetch_vectors(self.vectorstore, missing) \
+            if missing else {}
+        selected, vectors = [], []
+        for doc in docs:
+            vector = known.get(document_key(doc))
+            if vector is None:
+                vector = fetched.get(doc.metadata.get("_id"))
+            if vector is not None:
+                selected.append(doc)
+                vectors.append(vector)
+        return selected, vectors
+
+    async def aspeculative_search(
+        self,
+        question: str,
+        condense: Awaitable[str],
+        k: int = 4,
+        selection: Optional[ContextSelection] = None
+    ) -> Tuple[str, List[Document]]:
+        """
+        Condense a follow up question and retrieve its documents, searching
+        for the raw question in the meantime, see ``speculative_search``.
+        """
+        new_question, docs, decision = await speculative_search(
+            question, condense,
+            lambda query: self.asimilarity_search(query, k, selection)
+        )
+        self.speculations[decision] += 1
+        return new_question, docs
+
+    def stats(self) -> Dict:
+        return {
+            "embeddings": self.embedding_cache.stats(),
+            "documents": self.documents_cache.stats(),
+            "speculations": dict(self.speculations),
+            "exact_matches": self.exact_matches,
+        }
@@ -1,46 +1,120 @@
+import asyncio
 import os
-from pathlib import Path
 from fastapi.routing import APIRouter
-from langchain_community.document_loaders import TextLoader
-from langchain_text_splitters.markdown import MarkdownTextSplitter
 from langchain_community.embeddings import OpenAIEmbeddings
-from langchain_community.vectorstores import Qdrant
-from .response import Responses
-from src.utils import save_files_locally
+from qdrant_client import QdrantClient
+from redis import asyncio as aioredis
+from src.embedding_store import EmbeddingStore
+from src.exceptions.pre_processing import (
+    NotFoundException, StillProcessingException
+)
+from src.generation import bump_generation, current_generation
+from src.indexing import VectorstoreIndexer
+from src.jobs import FAILED, RUNNING, IngestionJob
+from src.lexical import (
+    HYBRID_RETRIEVAL, BM25Index, lexical_index_key, retire_lexical_index,
+    save_lexical_index
+)
+from src.responses.response import Responses
+from src.utils import (
+    iter_documents, list_documents, redis_client, save_etags
+)
 
 
 router = APIRouter(tags=['data_processing'])
+async_redis_client = aioredis.Redis(host=os.getenv('REDIS_HOST'), port=os.getenv('REDIS_PORT'), db=0)
 
+# Keep a reference to the running jobs so they are not garbage collected
+_jobs = set()
 
-@router.get("/create_vectorstore")
-async def create_vectorstore():
 
-    save_files_locally()
+async def run_ingestion(job: IngestionJob):
+    """Sync the vectorstore with the bucket, reporting progress to job."""
+    async with job:
+        indexer = VectorstoreIndexer(
+            QdrantClient(
+                url=os.getenv("QDRANT_URL"),
+                prefer_grpc=True,
+                api_key=os.getenv("QDRANT_KEY"),
+            ),
+            # Rate limits are retried by the embedding pipeline
+            EmbeddingStore(redis_client, OpenAIEmbeddings(max_retries=1)),
+        )
+        existing = await asyncio.to_thread(indexer.existing_points)
+        keys, unchanged, etags = await asyncio.to_thread(
+            list_documents, set(existing.values()), indexer.chunking
+        )
+        job.set_documents_total(len(keys))
+
+        summary = await indexer.aindex(
+            iter_documents(keys), unchanged, existing,
+            on_document=job.track_documents,
+            on_chunk=job.track_chunks,
+            on_progress=job.track,
+        )
+        await asyncio.to_thread(save_etags, etags, indexer.chunking)
+        changed = bool(summary["added"] or summary["removed"])
+        if HYBRID_RETRIEVAL:
+            await build_lexical_index(indexer, changed)
+        if changed:
+            generation = await asyncio.to_thread(
+                bump_generation, redis_client
+            )
+            if HYBRID_RETRIEVAL:
+                await asyncio.to_thread(
+                    retire_lexical_index, redis_client, generation - 1
+                )
+        job.result = summary
 
-    markdown_path = Path(__file__).parent.parent
-    markdown_path = markdown_path / 'chatbot_data'
-    data = []
-    for file in markdown_path.glob('*.md'):
-        loader = TextLoader(str(file))
-        data += loader.load()
-        os.remove(str(file))
 
-    text_splitter = MarkdownTextSplitter(
-        chunk_size=2000,
-        chunk_overlap=200,
+async def build_lexical_index(indexer: VectorstoreIndexer, changed: bool):
+    """
+    Index the chunks of the collection for lexical search, under the
+    generation the collection is about to get. The ingestion lock
+    guarantees nobody else bumps it meanwhile.
+    """
+    generation = await asyncio.to_thread(current_generation, redis_client)
+    generation += changed
+    key = lexical_index_key(generation)
+    if not changed and await async_redis_client.exists(key):
+        # Indexes stored with a TTL by earlier versions must not expire
+        await async_redis_client.persist(key)
+        return
+    index = await asyncio.to_thread(
+        BM25Index.from_collection, indexer.client, indexer.collection_name
     )
-    data = text_splitter.split_documents(data)
-
-    embeddings = OpenAIEmbeddings()
-
-    Qdrant.from_documents(
-        data,
-        embeddings,
-        url=os.getenv("QDRANT_URL"),
-        prefer_grpc=True,
-        api_key=os.getenv("QDRANT_KEY"),
-        collection_name="myvectorstore",
-        force_recreate=True,
+    await asyncio.to_thread(
+        save_lexical_index, redis_client, index, generation
     )
 
-    return Responses.ok("Vectorstore updated")
+
+@router.get("/create_vectorstore")
+async def create_vectorstore():
+    # The lock of the running job may expire between the two calls
+    for _ in range(3):
+        job = await IngestionJob.create(async_redis_client)
+        if job is not None:
+            break
+        running_id = await IngestionJob.running_id(async_redis_client)
+        if running_id is not None:
+            return Responses.pending({"job_id": running_id, "status": RUNNING})
+    else:
+        raise StillProcessingException()
+
+    task = asyncio.create_task(run_ingestion(job))
+    _jobs.add(task)
+    task.add_done_callback(_jobs.discard)
+
+    return Responses.accepted({"job_id": job.job_id, "status": RUNNING})
+
+
+@router.get("/create_vectorstore/{job_id}")
+async def get_ingestion_status(job_id: str):
+    status = await IngestionJob.load(async_redis_client, job_id)
+    if status is None:
+        raise NotFoundException(f"There is no ingestion job {job_id}")
+    if status["status"] == RUNNING:
+        return Responses.pending(status)
+    if status["status"] == FAILED:
+        return Responses.internal_server_error(status["error"])
+    return Responses.ok(status)
@@ -2,42 +2,157 @@
 import os
 import asyncio
 import logging
-from typing import AsyncIterable
+from typing import AsyncIterable, List, Optional, Tuple
 import json
 from time import time
-from collections import deque
-import pickle
 
 # import pandas as pd
-from fastapi import WebSocket, WebSocketDisconnect
+from fastapi import Request, WebSocket, WebSocketDisconnect
 from fastapi.routing import APIRouter
 from fastapi.responses import StreamingResponse
 from langchain.callbacks import AsyncIteratorCallbackHandler
-import redis
-from qdrant_client import QdrantClient
+from langchain.chains.llm import LLMChain
+from langchain.schema import Document
+from redis import asyncio as aioredis
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from langchain_community.vectorstores import Qdrant
 from langchain_community.embeddings import OpenAIEmbeddings
 
 from src.callback import StreamingLLMCallbackHandler
-from lib.assistants import (
-    get_chain_v0_simple, get_chain_stream, get_chain_from_scratch_stream, get_chain_from_scratch
+from src.compression import CONTEXT_COMPRESSION, SentenceCompressor
+from src.context_packer import ContextPacker
+from src.generation import GenerationTracker
+from src.lexical import HYBRID_RETRIEVAL, LexicalSearch, is_exact_match
+from src.local_index import LOCAL_VECTOR_INDEX, LocalVectorStore
+from src.cache import TwoLevelCache
+from src.memory import (
+    CONDENSE_CACHE_SIZE, MEMORY_WINDOW, ConversationMemory, condense_key
 )
+from src.retrieval import CachedRetrieval
+from src.semantic_cache import SemanticCache
+from src.sse import SSE_HEADERS, stream_events
+from src.standalone import STANDALONE_CLASSIFIER, StandaloneClassifier
+from src.turns import ASSISTANT, HUMAN, Turn
+from src.websocket_writer import WebSocketWriter
+from lib.assistants import ChainRegistry
+from lib.context_selection import ContextSelection
+from lib.speculative import SPECULATIVE_RETRIEVAL
 from src.schemas import ChatResponse, InputRequest
-from src.utils import format_conversation, format_docs
+from src.utils import format_conversation
+from .response import Responses
 
 
 router = APIRouter(tags=['virtual_assistant'])
-redis_client = redis.Redis(host=os.getenv('REDIS_HOST'), port=os.getenv('REDIS_PORT'), db=0)
+redis_client = aioredis.Redis(host=os.getenv('REDIS_HOST'), port=os.getenv('REDIS_PORT'), db=0)
+memory_store = ConversationMemory(redis_client)
 
 client = QdrantClient(
     url=os.getenv('QDRANT_URL'),
     api_key=os.getenv('QDRANT_KEY'),
     https=True,
 )
+async_client = AsyncQdrantClient(
+    url=os.getenv('QDRANT_URL'),
+    api_key=os.getenv('QDRANT_KEY'),
+    https=True,
+)
 
 embeddings = OpenAIEmbeddings()
 collection_name = "myvectorstore"
-qdrant = Qdrant(client, collection_name, embeddings=embeddings)
+generations = GenerationTracker(redis_client)
+if LOCAL_VECTOR_INDEX:
+    qdrant = LocalVectorStore(
+        embeddings, client, collection_name, generations
+    )
+else:
+    qdrant = Qdrant(
+        client, collection_name, embeddings=embeddings,
+        async_client=async_client
+    )
+registry = ChainRegistry(qdrant)
+lexical = LexicalSearch(redis_client, generations) \
+    if HYBRID_RETRIEVAL else None
+retrieval = CachedRetrieval(
+    qdrant, redis_client, generations, lexical=lexical
+)
+semantic_cache = SemanticCache(redis_client, generations)
+standalone = StandaloneClassifier(retrieval.aembed_query)
+context_packer = ContextPacker(
+    compressor=SentenceCompressor() if CONTEXT_COMPRESSION else None
+)
+# A condensation is only reused while its conversation is remembered
+condensed_questions = TwoLevelCache(
+    redis_client, "condensed_question", CONDENSE_CACHE_SIZE, MEMORY_WINDOW
+)
+
+
+@router.on_event("startup")
+async def load_local_index():
+    """Load the in-process replica before the first question, if enabled."""
+    if LOCAL_VECTOR_INDEX:
+        try:
+            await qdrant.sync()
+        except Exception as e:
+            logging.error(f"Could not load the local vector index: {e}")
+
+
+@router.on_event("startup")
+async def load_tokenizer():
+    """Load the tokenizer before the first question, off the event loop."""
+    await asyncio.to_thread(context_packer.load_tokenizer)
+
+
+async def condense_question(
+    memory_chain: LLMChain,
+    memory: List[Turn],
+    question: str,
+    selection: Optional[ContextSelection] = None
+) -> Tuple[str, Optional[List[Document]]]:
+    """
+    Rephrase a follow up question as a standalone one, unless the local
+    classifier finds it already is or the same question was condensed with
+    the same history. In speculative mode its documents are retrieved at
+    the same time, otherwise they are None.
+    """
+    if not memory:
+        return question, None
+    if STANDALONE_CLASSIFIER \
+            and not await standalone.needs_condense(question, memory):
+        return question, None
+    history = format_conversation(memory)
+    key = condense_key(history, question)
+    new_question = await condensed_questions.get(key)
+    if new_question is not None:
+        return new_question, None
+
+    condense = memory_chain.arun(
+        {
+            "chat_history": history,
+            "question": question
+        }
+    )
+    if SPECULATIVE_RETRIEVAL:
+        new_question, docs = await retrieval.aspeculative_search(
+            question, condense, selection=selection
+        )
+    else:
+        new_question, docs = await condense, None
+    await condensed_questions.set(key, new_question)
+    return new_question, docs
+
+
+async def lookup_answer(
+    question: str
+) -> Tuple[Optional[List[float]], Optional[str]]:
+    """
+    Embed a standalone question and look its answer up in the semantic
+    cache. Exact-match questions skip both: a product code one character
+    away embeds the same but asks something else.
+    """
+    if HYBRID_RETRIEVAL and is_exact_match(question):
+        return None, None
+    embedding = await retrieval.aembed_query(question)
+    return embedding, await semantic_cache.lookup(embedding)
 
 
 @router.post("/chat")
@@ -47,64 +162,37 @@ async def ask_question(
 ):
     """Handle a POST request to ask a question and return a response."""
     try:
-        memory_chain, question_chain = get_chain_from_scratch()
+        memory_chain, question_chain = registry.get_chain_from_scratch()
         question = input
 
-        # Retrieve the pickled data from Redis
-        memory = redis_client.get(user_id)
-
-        # Filter memory by date
-        if memory:
-            # Unpickle the data
-            memory = pickle.loads(memory)
-            memory = \
-                deque(
-                    [
-                        conv for conv in memory
-                        if (time() - conv["datetime"]) <= 120
-                    ],
-                    maxlen=4
-                )
-        else:
-            memory = []
+        # Retrieve the conversation from Redis, expired ones are empty
+        memory = await memory_store.load(user_id)
 
-        if memory:
-            new_question = memory_chain.run(
+        new_question, docs = await condense_question(
+            memory_chain, memory, question, registry.selection
+        )
+        embedding, result = await lookup_answer(new_question)
+        if result is None:
+            if docs is None:
+                docs = await retrieval.asimilarity_search(
+                    new_question, selection=registry.selection
+                )
+            result = await question_chain.arun(
                 {
-                    "chat_history": format_conversation(memory),
-                    "question": question
+                    "context": context_packer.pack(
+                        docs, query=new_question
+                    ).text,
+                    "new_question": new_question
                 }
             )
-        else:
-            new_question = question
-        docs = qdrant.similarity_search(
-            new_question, k=4
-        )
-        result = question_chain.run(
-            {
-                "context": format_docs(docs),
-                "new_question": new_question
-            }
-        )
+            if embedding is not None:
+                await semantic_cache.add(embedding, result)
         end_time = time()
-        memory.append(
-            {
-                "Agent": "Human",
-                "text": new_question,
-                "datetime": end_time
-            }
+        await memory_store.append(
+            user_id,
+            Turn(HUMAN, new_question, end_time),
+            Turn(ASSISTANT, result, end_time)
         )
-        memory.append(
-            {
-                "Agent": "Assistant",
-                "text": result,
-                "datetime": end_time
-            }
-        )
-        pickled_data = pickle.dumps(memory)
-
-        # Store the pickled data in Redis
-        redis_client.set(user_id, pickled_data)
     
         return {'data': result}
     
@@ -114,126 +202,185 @@ async def ask_question(
         return {'text': error_message, 'source': None}
 
 
+async def answer_message(
+    writer: WebSocketWriter,
+    stream_handler: StreamingLLMCallbackHandler,
+    memory_chain: LLMChain,
+    question_chain: LLMChain,
+    question: str,
+    user_id: str
+) -> None:
+    """Stream the answer of a websocket message, from start to end frame."""
+    try:
+        # Construct a response
+        start_resp = ChatResponse(sender="bot", message="", type="start")
+        await writer.send_json(start_resp.dict())
+
+        # Retrieve the conversation from Redis, expired ones are empty
+        memory = await memory_store.load(user_id)
+
+        # logging.info(len(memory))
+        new_question, docs = await condense_question(
+            memory_chain, memory, question, registry.selection
+        )
+        embedding, answer = await lookup_answer(new_question)
+        if answer is None:
+            if docs is None:
+                docs = await retrieval.asimilarity_search(
+                    new_question, selection=registry.selection
+                )
+            result = await question_chain.acall(
+                {
+                    "context": context_packer.pack(
+                        docs, query=new_question
+                    ).text,
+                    "new_question": new_question
+                },
+                callbacks=[stream_handler]
+            )
+            answer = result['answer']
+            if embedding is not None:
+                await semantic_cache.add(embedding, answer)
+        else:
+            await stream_handler.replay(answer)
+        end_time = time()
+        await memory_store.append(
+            user_id,
+            Turn(HUMAN, new_question, end_time),
+            Turn(ASSISTANT, answer, end_time)
+        )
+
+        await stream_handler.flush()
+        end_resp = ChatResponse(sender="bot", message="", type="end")
+        await writer.send_json(end_resp.dict())
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logging.error(e)
+        if writer.closed:
+            return
+        resp = ChatResponse(
+            sender="bot",
+            message="Sorry, something went wrong. Try again.",
+            type="error",
+        )
+        await writer.send_json(resp.dict())
+
+
+async def cancel_task(task: Optional[asyncio.Task]) -> bool:
+    """Cancel a task and wait for it, return whether it was running."""
+    if task is None or task.done():
+        return False
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return True
+
+
 @router.websocket("/chat")
 async def websocket_endpoint(
         websocket: WebSocket
         ):
     await websocket.accept()
-    stream_handler = StreamingLLMCallbackHandler(websocket)
-    memory_chain, question_chain = get_chain_from_scratch_stream(stream_handler)
+    # Frames go through a writer task, a slow client never stalls the LLM
+    writer = WebSocketWriter(websocket).start()
+    stream_handler = StreamingLLMCallbackHandler(writer)
+    memory_chain, question_chain = registry.get_chain_from_scratch_stream()
+    # Answers run as a task, so messages are received while streaming
+    answer: Optional[asyncio.Task] = None
 
-    while True:
-        try:
-            # Receive and send back the client message
-            question = await websocket.receive_text()
-            question = f'{{"message": "{question.strip()}", "user": "12355434"}}'
-            question_dict = json.loads(question)
-            question = question_dict['message']
+    try:
+        while True:
+            try:
+                # Receive and send back the client message
+                question = await websocket.receive_text()
+                question = f'{{"message": "{question.strip()}", "user": "12355434"}}'
+                question_dict = json.loads(question)
+                question = question_dict['message']
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                logging.error(e)
+                if writer.closed:
+                    break
+                resp = ChatResponse(
+                    sender="bot",
+                    message="Sorry, something went wrong. Try again.",
+                    type="error",
+                )
+                await writer.send_json(resp.dict())
+                continue
 
+            # A newer message supersedes the answer being streamed
+            if await cancel_task(answer):
+                stream_handler.discard()
+                cancelled_resp = ChatResponse(
+                    sender="bot", message="", type="cancelled"
+                )
+                await writer.send_json(cancelled_resp.dict())
 
             resp = ChatResponse(
                       sender="you", message=question, type="stream"
                       )
-            await websocket.send_json(resp.dict())
-
-            # Construct a response
-            start_resp = ChatResponse(sender="bot", message="", type="start")
-            await websocket.send_json(start_resp.dict())
-
-            # Retrieve the pickled data from Redis
-            memory = redis_client.get(question_dict['user'])
-
-            # Filter memory by date
-            if memory:
-                # Unpickle the data
-                memory = pickle.loads(memory)
-                memory = \
-                    deque(
-                        [
-                            conv for conv in memory
-                            if (time() - conv["datetime"]) <= 120
-                        ],
-                        maxlen=4
-                    )
-                # logging.warning(len(memory))
-            else:
-                memory = []
-
-            # logging.info(len(memory))
-            if memory:
-                new_question = memory_chain.run(
-                    {
-                        "chat_history": format_conversation(memory),
-                        "question": question
-                    }
-                )
-            else:
-                new_question = question
-            docs = await qdrant.asimilarity_search(
-                new_question, k=4
-            )
-            result = await question_chain.acall(
-                {
-                    "context": format_docs(docs),
-                    "new_question": new_question
-                }
-            )
-            end_time = time()
-            memory.append(
-                {
-                    "Agent": "Human",
-                    "text": new_question,
-                    "datetime": end_time
-                }
-            )
-            memory.append(
-                {
-                    "Agent": "Assistant",
-                    "text": result['answer'],
-                    "datetime": end_time
-                }
-            )
-            pickled_data = pickle.dumps(memory)
-
-            # Store the pickled data in Redis
-            redis_client.set(question_dict['user'], pickled_data)
+            await writer.send_json(resp.dict())
 
-            end_resp = ChatResponse(sender="bot", message="", type="end")
-            await websocket.send_json(end_resp.dict())
-        except WebSocketDisconnect:
-            logging.info("websocket disconnect")
-            break
-        except Exception as e:
-            logging.error(e)
-            resp = ChatResponse(
-                sender="bot",
-                message="Sorry, something went wrong. Try again.",
-                type="error",
-            )
-            await websocket.send_json(resp.dict())
+            answer = asyncio.create_task(answer_message(
+                writer, stream_handler, memory_chain, question_chain,
+                question, question_dict['user']
+            ))
+    except WebSocketDisconnect:
+        logging.info(f"websocket disconnect {writer.stats()}")
+    finally:
+        # Stop the generation of a client that is gone
+        await cancel_task(answer)
+        await writer.close()
 
 
 # Stream request
-async def send_message(question: str) -> AsyncIterable[str]:
+async def send_message(
+    question: str,
+    request: Request
+) -> AsyncIterable[str]:
     callback = AsyncIteratorCallbackHandler()
-    qa = get_chain_stream(qdrant, callback)
+    qa = registry.get_chain_stream()
 
     task = asyncio.create_task(
-        qa.acall({"question": question})
+        qa.acall(
+            {"question": question, "chat_history": []},
+            callbacks=[callback]
+        )
     )
-
+    # End the tokens when the chain fails outside of the LLM call
+    task.add_done_callback(lambda _: callback.done.set())
+    events = stream_events(task, callback.aiter(), request.is_disconnected)
     try:
-        async for token in callback.aiter():
-            yield token
-    except Exception as e:
-        print(f"Caught exception: {e}")
+        async for event in events:
+            yield event
     finally:
-        callback.done.set()
-
-    await task
+        # Cancels the LLM call if the response stopped early
+        await events.aclose()
 
 
 @router.post("/stream_chat/")
-async def stream_chat(message: InputRequest):
-    generator = send_message(message.input)
-    return StreamingResponse(generator, media_type="text/event-stream")
+async def stream_chat(message: InputRequest, request: Request):
+    generator = send_message(message.input, request)
+    return StreamingResponse(
+        generator, media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
+
+@router.get("/cache_stats")
+async def cache_stats():
+    return Responses.ok(
+        {
+            **retrieval.stats(),
+            "answers": semantic_cache.stats(),
+            "condense": {
+                **standalone.stats(),
+                "cache": condensed_questions.stats(),
+            },
+            "context": context_packer.stats(),
+        }
+    )
@@ -1,4 +1,8 @@
 """Schemas for the chat app."""
+import json
+from json.encoder import encode_basestring_ascii
+from typing import Tuple
+
 from pydantic import BaseModel, validator
 
 
@@ -17,10 +21,33 @@ class ChatResponse(BaseModel):
 
     @validator("type")
     def validate_message_type(cls, v):
-        if v not in ["start", "stream", "end", "error", "info"]:
+        if v not in ["start", "stream", "end", "error", "info", "cancelled"]:
             raise ValueError("type must be start, stream or end")
         return v
 
 
+def _envelope(sender: str, type: str) -> Tuple[str, str]:
+    """JSON of a ChatResponse around its message, as sent by send_json."""
+    placeholder = encode_basestring_ascii("\0")
+    frame = json.dumps(
+        ChatResponse(sender=sender, message="\0", type=type).dict()
+    )
+    head, tail = frame.split(placeholder)
+    return head, tail
+
+
+# Stream frames are sent once per token: their envelope is validated and
+# serialized once, and only the message is escaped per frame
+_STREAM_ENVELOPES = {
+    sender: _envelope(sender, "stream") for sender in ("bot", "you")
+}
+
+
+def encode_stream_frame(message: str, sender: str = "bot") -> str:
+    """JSON text of a stream ChatResponse, the same as ``send_json`` sends."""
+    head, tail = _STREAM_ENVELOPES[sender]
+    return head + encode_basestring_ascii(message) + tail
+
+
 class InputRequest(BaseModel):
     input: str = "What is aws sagemaker?"
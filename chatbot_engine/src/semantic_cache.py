@@ -0,0 +1,166 @@
+"""Semantic cache of answers to past condensed questions."""
+import os
+from time import monotonic
+from typing import Dict, List, Optional
+
+import msgpack
+import numpy as np
+
+from .generation import GenerationTracker
+
+
+# Minimum cosine similarity to reuse an answer, above 1 disables the cache
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))
+# Answers kept per collection generation
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", 1000))
+# Seconds an answer lives in Redis
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", 24 * 3600))
+# Seconds between two reloads of the answers added by other workers
+SEMANTIC_CACHE_REFRESH = float(os.getenv("SEMANTIC_CACHE_REFRESH", 5))
+
+# Entries pushed since a worker last synced, given the number it has seen,
+# or the whole list when it has to reload: first load, counter reset or
+# more new entries than the list still holds
+_NEW_ENTRIES = """
+local count = tonumber(redis.call('get', KEYS[2]) or '0')
+local new = count - tonumber(ARGV[1])
+if ARGV[2] == '1' or new < 0 or new >= redis.call('llen', KEYS[1]) then
+    return {count, 1, redis.call('lrange', KEYS[1], 0, -1)}
+end
+if new == 0 then
+    return {count, 0, {}}
+end
+return {count, 0, redis.call('lrange', KEYS[1], -new, -1)}
+"""
+
+
+class SemanticCache:
+    """
+    Answers of past condensed questions, looked up by embedding similarity.
+
+    Entries are stored in a Redis list per collection generation, so a
+    vectorstore rebuild invalidates them. Every worker mirrors the list of
+    the current generation in a normalized NumPy matrix and answers a lookup
+    with a single matrix-vector product. A counter of the entries pushed
+    lets the workers only fetch the new ones every ``refresh`` seconds.
+
+    Args:
+        redis_client (redis.asyncio.Redis): client used to share the answers
+        generations (GenerationTracker): source of the collection generation
+        threshold (float): minimum cosine similarity to reuse an answer
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        generations: GenerationTracker,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        maxsize: int = SEMANTIC_CACHE_SIZE,
+        ttl: int = SEMANTIC_CACHE_TTL,
+        refresh: float = SEMANTIC_CACHE_REFRESH
+    ):
+        self.redis_client = redis_client
+        self.generations = generations
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self._generation = None
+        self._loaded_at = None
+        self._seen = 0
+        self._matrix = None
+        self._answers: List[str] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold <= 1
+
+    @staticmethod
+    def key(generation: int) -> str:
+        return f"semantic_cache:{generation}"
+
+    @staticmethod
+    def count_key(generation: int) -> str:
+        return f"semantic_cache:{generation}:count"
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    async def _sync(self) -> int:
+        generation = await self.generations.current()
+        now = monotonic()
+        if (
+            generation == self._generation
+            and now - self._loaded_at < self.refresh
+        ):
+            return generation
+
+        reload = generation != self._generation
+        count, full, records = await self.redis_client.eval(
+            _NEW_ENTRIES, 2, self.key(generation), self.count_key(generation),
+            0 if reload else self._seen, int(reload)
+        )
+        answers, vectors = [], []
+        for record in records:
+            answer, embedding = msgpack.unpackb(record)
+            answers.append(answer)
+            vectors.append(np.frombuffer(embedding, dtype=np.float32))
+        rows = self._normalize(np.vstack(vectors)) if vectors else None
+        if full:
+            self._answers, self._matrix = answers, rows
+        elif rows is not None:
+            self._append(rows, answers)
+        self._seen = count
+        self._generation = generation
+        self._loaded_at = now
+        return generation
+
+    async def lookup(self, embedding: List[float]) -> Optional[str]:
+        """Return the answer of the most similar past question, if any."""
+        if not self.enabled:
+            return None
+        await self._sync()
+        if self._matrix is not None:
+            query = self._normalize(np.asarray(embedding, dtype=np.float32))
+            scores = self._matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                self.hits += 1
+                return self._answers[best]
+        self.misses += 1
+        return None
+
+    async def add(self, embedding: List[float], answer: str) -> None:
+        if not self.enabled:
+            return
+        generation = await self._sync()
+        vector = np.asarray(embedding, dtype=np.float32)
+        key, count_key = self.key(generation), self.count_key(generation)
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.rpush(key, msgpack.packb([answer, vector.tobytes()]))
+        pipe.ltrim(key, -self.maxsize, -1)
+        pipe.expire(key, self.ttl)
+        pipe.incr(count_key)
+        pipe.expire(count_key, self.ttl)
+        count = (await pipe.execute())[3]
+
+        # Entries of other workers pushed in between come with the next sync
+        if count == self._seen + 1 and generation == self._generation:
+            self._append(self._normalize(vector)[np.newaxis], [answer])
+            self._seen = count
+
+    def _append(self, rows: np.ndarray, answers: List[str]) -> None:
+        self._matrix = rows if self._matrix is None \
+            else np.vstack([self._matrix, rows])[-self.maxsize:]
+        self._answers = (self._answers + answers)[-self.maxsize:]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size_local": len(self._answers),
+        }
@@ -0,0 +1,104 @@
+"""Server-sent events framing of streamed answers."""
+import asyncio
+import logging
+import os
+import re
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+
+# Seconds without a token after which a comment keeps the stream alive
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", 15))
+
+TOKEN = "token"
+DONE = "done"
+ERROR = "error"
+DONE_DATA = "[DONE]"
+ERROR_DATA = "Sorry, something went wrong. Try again."
+# Keep proxies such as nginx from caching or buffering the stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+
+def format_event(
+    data: str,
+    event: Optional[str] = None,
+    id: Optional[int] = None
+) -> str:
+    """Frame ``data`` as an event, one ``data`` field per line."""
+    fields = []
+    if event is not None:
+        fields.append(f"event: {event}")
+    if id is not None:
+        fields.append(f"id: {id}")
+    fields.extend(f"data: {line}" for line in _LINE_BREAK.split(data))
+    return "\n".join(fields) + "\n\n"
+
+
+def format_comment(text: str = "ping") -> str:
+    return f": {text}\n\n"
+
+
+async def stream_events(
+    task: asyncio.Future,
+    tokens: AsyncIterator[str],
+    is_disconnected: Callable[[], Awaitable[bool]],
+    heartbeat: float = SSE_HEARTBEAT_SECONDS
+) -> AsyncIterator[str]:
+    """
+    Stream the tokens of an LLM task as server-sent events.
+
+    Every token is a ``token`` event with an increasing id, and the stream
+    ends with a ``done`` event, or an ``error`` event if the task failed.
+    A comment is sent after ``heartbeat`` seconds without a token, and the
+    client is checked every ``heartbeat`` seconds. If it is gone, or the
+    response is cancelled or closed early, the task is cancelled at once so
+    it stops consuming tokens.
+
+    Args:
+        task (asyncio.Future): LLM call producing ``tokens``
+        tokens (AsyncIterator[str]): tokens of the answer
+        is_disconnected (Callable): coroutine function telling whether
+            the client is gone
+        heartbeat (float): seconds between two comments when idle
+    """
+    iterator = tokens.__aiter__()
+    next_token: Optional[asyncio.Future] = None
+    event_id = 0
+    loop = asyncio.get_running_loop()
+    check_at = loop.time() + heartbeat
+    try:
+        while True:
+            if loop.time() >= check_at:
+                if await is_disconnected():
+                    logging.info("SSE client disconnected, answer cancelled")
+                    return
+                check_at = loop.time() + heartbeat
+            if next_token is None:
+                next_token = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({next_token}, timeout=heartbeat)
+            if not done:
+                yield format_comment()
+                continue
+            try:
+                token = next_token.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                next_token = None
+            event_id += 1
+            yield format_event(token, TOKEN, event_id)
+
+        event_id += 1
+        try:
+            await task
+        except Exception as e:
+            logging.error(e)
+            yield format_event(ERROR_DATA, ERROR, event_id)
+        else:
+            yield format_event(DONE_DATA, DONE, event_id)
+    finally:
+        if next_token is not None:
+            next_token.cancel()
+        if not task.done():
+            task.cancel()
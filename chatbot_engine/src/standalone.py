@@ -0,0 +1,121 @@
+"""Local classifier of follow up questions that need no condensing."""
+import asyncio
+import os
+import re
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+from lib.speculative import content_terms
+
+from .turns import HUMAN, Turn
+
+
+# Off by default, the similarity threshold has not been measured on real
+# conversations yet
+STANDALONE_CLASSIFIER = os.getenv(
+    "STANDALONE_CLASSIFIER", "false"
+).lower() in ("1", "true", "yes")
+# Cosine similarity to a recent question above which a follow up is taken
+# as a continuation of it, above 1 disables the embedding feature
+STANDALONE_SIMILARITY_THRESHOLD = float(
+    os.getenv("STANDALONE_SIMILARITY_THRESHOLD", 0.9)
+)
+# Fewer words than this make a question elliptical
+STANDALONE_MIN_WORDS = int(os.getenv("STANDALONE_MIN_WORDS", 3))
+
+_REFERENCES = frozenset("""
+it its itself they them their theirs themselves this that these those
+he him his she her hers one ones former latter same such above previous
+""".split())
+_CONTINUATIONS = re.compile(
+    r"^(and|or|but|so|also|then|what about|how about|why not|what else|"
+    r"anything else|tell me more|more|else|same|too|as well)\b"
+)
+
+# Function words of English questions, the cues above only cover English
+# and questions in other languages are always condensed
+_ENGLISH = frozenset("""
+what whats how why when where which who whom whose is are was were do does
+did can could should would will shall may might must have has had the an
+of for to with from about between and or not i my me we our you your
+explain describe compare list show tell give
+""".split())
+_NON_ENGLISH = re.compile(r"[^\x00-\x7f\u2018\u2019\u201c\u201d]")
+
+Embed = Callable[[str], Awaitable[List[float]]]
+
+
+def _cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(a, axis=-1) * np.linalg.norm(b)
+    return a @ b / np.maximum(norms, 1e-12)
+
+
+class StandaloneClassifier:
+    """
+    Decide whether a follow up question must be condensed with the chat
+    history or can be used as is, saving an LLM round trip.
+
+    A question needs condensing when it refers to something said before
+    (pronouns and demonstratives), is elliptical (starts like a
+    continuation, has fewer than ``min_words`` words or only stopwords),
+    or when its embedding is at least ``threshold`` similar to one of the
+    recent questions of the conversation. The cues are English, so
+    questions that do not look English are always condensed.
+
+    Args:
+        embed (Callable): coroutine function embedding a text, None
+            disables the similarity feature
+        threshold (float): minimum similarity to a recent question
+        min_words (int): minimum number of words
+    """
+
+    def __init__(
+        self,
+        embed: Optional[Embed] = None,
+        threshold: float = STANDALONE_SIMILARITY_THRESHOLD,
+        min_words: int = STANDALONE_MIN_WORDS
+    ):
+        self.embed = embed
+        self.threshold = threshold
+        self.min_words = min_words
+        self.condensed = 0
+        self.skipped = 0
+
+    def cue(self, question: str) -> Optional[str]:
+        """Return the heuristic that makes a question dependent, if any."""
+        words = re.findall(r"\w+", question.lower())
+        if _NON_ENGLISH.search(question) or not _ENGLISH.intersection(words):
+            return "language"
+        if _REFERENCES.intersection(words):
+            return "reference"
+        if _CONTINUATIONS.match(" ".join(words)):
+            return "continuation"
+        if len(words) < self.min_words or not content_terms(question):
+            return "ellipsis"
+        return None
+
+    async def similarity(self, question: str, memory: List[Turn]) -> float:
+        """Highest cosine similarity to the questions of ``memory``."""
+        previous = [turn.text for turn in memory if turn.agent == HUMAN]
+        if self.embed is None or self.threshold > 1 or not previous:
+            return 0.0
+        query = np.asarray(await self.embed(question))
+        matrix = np.asarray(
+            await asyncio.gather(*(self.embed(text) for text in previous))
+        )
+        return float(np.max(_cosine(matrix, query)))
+
+    async def needs_condense(self, question: str, memory: List[Turn]) -> bool:
+        if not memory:
+            return False
+        needed = self.cue(question) is not None \
+            or await self.similarity(question, memory) >= self.threshold
+        if needed:
+            self.condensed += 1
+        else:
+            self.skipped += 1
+        return needed
+
+    def stats(self) -> Dict[str, int]:
+        return {"condensed": self.condensed, "skipped": self.skipped}
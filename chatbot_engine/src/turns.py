@@ -0,0 +1,66 @@
+"""Conversation turns and their storage codec."""
+import json
+import os
+import zlib
+from typing import NamedTuple
+
+import msgpack
+
+
+CODEC_VERSION = 1
+FLAG_COMPRESSED = 0x01
+# Texts longer than this (in bytes) are stored zlib compressed
+COMPRESS_THRESHOLD = int(os.getenv("TURN_COMPRESS_THRESHOLD", 512))
+
+HUMAN = "Human"
+ASSISTANT = "Assistant"
+_AGENT_CODES = {HUMAN: 0, ASSISTANT: 1}
+_AGENTS = {code: agent for agent, code in _AGENT_CODES.items()}
+
+
+class Turn(NamedTuple):
+    """A message of a conversation."""
+
+    agent: str
+    text: str
+    datetime: float
+
+
+def encode_turn(
+    turn: Turn,
+    compress_threshold: int = COMPRESS_THRESHOLD
+) -> bytes:
+    """
+    Encode a turn as ``[version, flags] + payload``
+
+    The payload is the msgpack array ``[agent, datetime, text]``, where
+    known agents are replaced by their code, zlib compressed when it is
+    longer than ``compress_threshold`` and compression makes it smaller.
+    """
+    payload = msgpack.packb(
+        [_AGENT_CODES.get(turn.agent, turn.agent), turn.datetime, turn.text]
+    )
+    flags = 0
+    if compress_threshold is not None and len(payload) > compress_threshold:
+        compressed = zlib.compress(payload)
+        if len(compressed) < len(payload):
+            payload = compressed
+            flags |= FLAG_COMPRESSED
+    return bytes((CODEC_VERSION, flags)) + payload
+
+
+def decode_turn(record: bytes) -> Turn:
+    """Decode a turn written by ``encode_turn``"""
+    if record[:1] == b"{":
+        # Plain JSON objects written before the codec existed
+        data = json.loads(record)
+        return Turn(data["Agent"], data["text"], data["datetime"])
+
+    version, flags = record[0], record[1]
+    if version != CODEC_VERSION:
+        raise ValueError(f"Unsupported turn codec version {version}")
+    payload = record[2:]
+    if flags & FLAG_COMPRESSED:
+        payload = zlib.decompress(payload)
+    agent, datetime, text = msgpack.unpackb(payload)
+    return Turn(_AGENTS.get(agent, agent), text, datetime)
@@ -1,15 +1,28 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
 import os
 
 from dotenv import load_dotenv
+from langchain.schema import Document
 import boto3
 import redis
 
 from src.exceptions.pre_processing import NotFoundException
+from src.turns import ASSISTANT, HUMAN
 
 
 redis_client = redis.Redis(host=os.getenv('REDIS_HOST'), port=os.getenv('REDIS_PORT'), db=0)
 
+S3_PREFIX = "chatbot_data"
+S3_MAX_WORKERS = int(os.getenv("S3_MAX_WORKERS", 16))
+# Documents downloaded ahead of the ingestion pipeline
+INGESTION_WINDOW = int(os.getenv("INGESTION_WINDOW", 32))
+ETAGS_KEY = "ingestion:etags"
+# Field of the ETag manifest holding the chunk parameters it was built with
+CHUNKING_FIELD = "__chunking__"
+
 
 def load_credentials():
     file_path = Path(__file__).resolve()
@@ -51,10 +64,10 @@ def load_file_to_redis(s3_file_path: str, file_hash: str):
 def format_conversation(conversation):
     formatted_conv = []
     for conv in conversation:
-        if conv["Agent"] == "Human":
-            formatted_doc = f"- Human: '{conv['text']}'"
-        elif conv["Agent"] == "Assistant":
-            formatted_doc = f"- AI assistant: '{conv['text']}'"
+        if conv.agent == HUMAN:
+            formatted_doc = f"- Human: '{conv.text}'"
+        elif conv.agent == ASSISTANT:
+            formatted_doc = f"- AI assistant: '{conv.text}'"
         formatted_conv.append(formatted_doc)
     return '\n'.join(formatted_conv)
 
@@ -83,26 +96,93 @@ def load_vectorstore_to_s3(local_file_path):
     # Upload the file to S3
     s3.upload_file(file, os.getenv("BUCKET_NAME"), str(file.name))
 
-def save_files_locally():
 
-    s3 = boto3.client(
+def _s3_client():
+    return boto3.client(
         's3',
         aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
         aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
     )
 
-    local_path = Path(__file__).parent
-    local_path = local_path / 'chatbot_data'
-    if not os.path.exists(str(local_path)):
-        os.mkdir(str(local_path))
 
-    response = s3.list_objects_v2(Bucket=os.getenv("BUCKET_NAME"), Prefix="chatbot_data") 
-
-    if 'Contents' in response:
-        for obj in response['Contents']:
-            current_path = local_path / obj['Key'].split('/')[-1]
-            s3.download_file(
-                os.getenv('BUCKET_NAME'), obj['Key'], str(current_path)
-            )
-    
-    
+def list_documents(
+    known_sources: Set[str] = frozenset(),
+    chunking: str = "",
+    prefix: str = S3_PREFIX,
+    suffix: str = ".md"
+) -> Tuple[List[str], Set[str], Dict[str, str]]:
+    """
+    List the documents of the bucket and find the ones to download.
+
+    The whole listing is paginated. Objects whose ETag matches the one
+    recorded by the last ingestion, and that are still in the vectorstore
+    (``known_sources``), do not need to be downloaded. The recorded ETags
+    are ignored when the last ingestion split documents with other chunk
+    parameters than ``chunking``, so every document is split again.
+
+    Args:
+        known_sources (set): sources present in the vectorstore
+        chunking (str): chunk parameters of the ingestion
+        prefix (str): prefix of the keys to list
+        suffix (str): suffix of the keys to list
+
+    Returns:
+        list: keys of the new or changed objects
+        set: sources of the unchanged objects
+        dict: ETag of every listed object, see ``save_etags``
+    """
+    s3 = _s3_client()
+    etags = {}
+    paginator = s3.get_paginator("list_objects_v2")
+    pages = paginator.paginate(Bucket=os.getenv("BUCKET_NAME"), Prefix=prefix)
+    for page in pages:
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith(suffix):
+                etags[obj["Key"]] = obj["ETag"]
+
+    previous = {
+        key.decode(): etag.decode()
+        for key, etag in redis_client.hgetall(ETAGS_KEY).items()
+    }
+    if previous.pop(CHUNKING_FIELD, None) != chunking:
+        previous = {}
+    unchanged = {
+        key for key, etag in etags.items()
+        if previous.get(key) == etag and key in known_sources
+    }
+    return sorted(set(etags) - unchanged), unchanged, etags
+
+
+def iter_documents(
+    keys: Iterable[str],
+    window: int = INGESTION_WINDOW
+) -> Iterator[Document]:
+    """
+    Download objects straight into memory and yield them as documents, in
+    the order of ``keys``, with at most ``window`` downloads in flight or
+    waiting to be consumed.
+    """
+    s3 = _s3_client()
+    bucket = os.getenv("BUCKET_NAME")
+
+    def download(key: str) -> Document:
+        body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+        return Document(page_content=body.decode(), metadata={"source": key})
+
+    workers = min(S3_MAX_WORKERS, window)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for key in keys:
+            pending.append(executor.submit(download, key))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def save_etags(etags: Dict[str, str], chunking: str = "") -> None:
+    """Record the ETags and chunk parameters of a successful ingestion"""
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(ETAGS_KEY)
+    pipe.hset(ETAGS_KEY, mapping={**etags, CHUNKING_FIELD: chunking})
+    pipe.execute()
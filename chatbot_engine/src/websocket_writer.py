@@ -0,0 +1,172 @@
+"""Per-connection websocket writer fed by a bounded send queue."""
+import asyncio
+import logging
+import os
+from collections import deque
+from time import monotonic
+from typing import Any, Deque, Dict, Optional, Union
+
+from fastapi import WebSocketDisconnect
+
+from .schemas import encode_stream_frame
+
+
+# Frames queued per connection before the overflow policy applies
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", 64))
+# What to do with a stream frame when the queue is full: "coalesce" it
+# into the last queued stream frame, or "drop" it
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "coalesce")
+# Seconds a client may keep its queue full, or take to receive a frame,
+# before it is disconnected
+WS_SLOW_CLIENT_TIMEOUT = float(os.getenv("WS_SLOW_CLIENT_TIMEOUT", 10))
+
+COALESCE = "coalesce"
+DROP = "drop"
+# Close code of a client disconnected for being too slow, "try again later"
+SLOW_CLIENT_CLOSE_CODE = 1013
+
+
+# Bot stream frames are queued as their message, other frames as a dict
+Frame = Union[str, Dict[str, Any]]
+
+
+class WebSocketWriter:
+    """
+    Send the frames of a websocket from a dedicated task, so producers such
+    as the LLM callbacks never wait on a slow client.
+
+    ``send_stream`` and ``send_json`` only queue the frame, bot stream
+    frames being encoded by ``encode_stream_frame`` when they are sent.
+    Once ``max_frames`` frames are queued, bot stream frames are coalesced
+    into the last queued one, or dropped, depending on ``policy``, while
+    other frames (start, end, error...) are always queued. A client keeping
+    its queue full, or taking more than ``slow_timeout`` seconds to receive
+    a frame, is disconnected and further sends raise ``WebSocketDisconnect``.
+
+    Args:
+        websocket (WebSocket): accepted connection
+        max_frames (int): queued frames before the overflow policy applies
+        policy (str): ``COALESCE`` or ``DROP``
+        slow_timeout (float): seconds before a slow client is disconnected
+    """
+
+    def __init__(
+        self,
+        websocket,
+        max_frames: int = WS_SEND_QUEUE_SIZE,
+        policy: str = WS_OVERFLOW_POLICY,
+        slow_timeout: float = WS_SLOW_CLIENT_TIMEOUT
+    ):
+        if policy not in (COALESCE, DROP):
+            raise ValueError(f"Unknown websocket overflow policy {policy}")
+        self.websocket = websocket
+        self.max_frames = max_frames
+        self.policy = policy
+        self.slow_timeout = slow_timeout
+        self.closed = False
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self._closing = False
+        self._queue: Deque[Frame] = deque()
+        self._full_since: Optional[float] = None
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> "WebSocketWriter":
+        self._task = asyncio.create_task(self._write())
+        return self
+
+    async def send_stream(self, message: str) -> None:
+        """Queue a bot stream frame, never waiting for the client."""
+        if self._full():
+            self._overflow(message)
+        else:
+            self._enqueue(message)
+
+    async def send_json(self, data: Dict[str, Any]) -> None:
+        """Queue a frame, never waiting for the client."""
+        self._full()
+        self._enqueue(data)
+
+    def _full(self) -> bool:
+        if self.closed:
+            raise WebSocketDisconnect(SLOW_CLIENT_CLOSE_CODE)
+        if len(self._queue) < self.max_frames:
+            return False
+        now = monotonic()
+        if self._full_since is None:
+            self._full_since = now
+        elif now - self._full_since > self.slow_timeout:
+            self._disconnect("kept its send queue full")
+            raise WebSocketDisconnect(SLOW_CLIENT_CLOSE_CODE)
+        return True
+
+    def _enqueue(self, frame: Frame) -> None:
+        self._queue.append(frame)
+        self._ready.set()
+
+    def _overflow(self, message: str) -> None:
+        last = self._queue[-1] if self._queue else None
+        if self.policy == COALESCE and isinstance(last, str):
+            self._queue[-1] = last + message
+            self.coalesced += 1
+        elif self.policy == COALESCE:
+            self._enqueue(message)
+        else:
+            self.dropped += 1
+
+    def _disconnect(self, reason: str) -> None:
+        logging.warning(f"Disconnecting slow websocket client, it {reason}")
+        self.closed = True
+        self._queue.clear()
+        self._ready.set()
+
+    async def _write(self) -> None:
+        while not self.closed:
+            if not self._queue:
+                if self._closing:
+                    return
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            frame = self._queue.popleft()
+            if len(self._queue) < self.max_frames:
+                self._full_since = None
+            try:
+                if isinstance(frame, str):
+                    send = self.websocket.send_text(encode_stream_frame(frame))
+                else:
+                    send = self.websocket.send_json(frame)
+                await asyncio.wait_for(send, self.slow_timeout)
+            except asyncio.TimeoutError:
+                self._disconnect("did not receive a frame in time")
+                break
+            except Exception:
+                # The client is gone, the receive loop sees the disconnect
+                self.closed = True
+                self._queue.clear()
+                return
+            self.sent += 1
+        try:
+            await self.websocket.close(code=SLOW_CLIENT_CLOSE_CODE)
+        except Exception:
+            pass
+
+    async def close(self) -> None:
+        """Send the queued frames, for up to ``slow_timeout`` seconds."""
+        if self._task is None:
+            return
+        self._closing = True
+        self._ready.set()
+        try:
+            await asyncio.wait_for(self._task, self.slow_timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+        }
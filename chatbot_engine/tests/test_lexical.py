@@ -0,0 +1,23 @@
+from src.lexical import is_exact_match
+
+
+def test_contractions_and_possessives_are_not_quotes():
+    assert not is_exact_match("What's SageMaker's pricing model?")
+    assert not is_exact_match(
+        "What's the difference between AWS's regions and zones?"
+    )
+
+
+def test_fully_quoted_query_is_classified_without_its_quotes():
+    assert not is_exact_match('"What is the pricing model of SageMaker?"')
+    assert not is_exact_match("“How do I deploy a model?”")
+    assert is_exact_match('"ml.g5.xlarge price"')
+
+
+def test_quoted_phrase_within_a_query_is_exact():
+    assert is_exact_match('Which instances support "elastic inference"?')
+
+
+def test_short_query_with_a_code_is_exact():
+    assert is_exact_match("ml.g5.xlarge price")
+    assert not is_exact_match("What is SageMaker?")
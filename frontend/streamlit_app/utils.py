@@ -1,4 +1,5 @@
 import os
+import time
 import requests
 import boto3
 from pathlib import Path
@@ -23,13 +24,31 @@ def get_response(body: any, user_id: any):
         print("Request failed:", response.status_code)
         return None
 
-def update_vectorstore():
+def update_vectorstore(poll_interval: float = 2, timeout: float = 3600):
     url = "http://" + os.getenv("CHATBOT_HOST") + ":" + os.getenv("CHATBOT_PORT") + "/create_vectorstore"
     headers = {"Content-type": "application/json"}
     response = requests.request("GET", url, headers=headers)
+    if response.status_code not in (200, 202):
+        print("Request failed:", response.status_code)
+        return None
+
+    # The ingestion runs in background, poll its status until it finishes
+    data = response.json()["data"]
+    job_id = data.get("job_id") if isinstance(data, dict) else None
+    if job_id is None:
+        print("Ingestion not started:", data)
+        return None
+    deadline = time.monotonic() + timeout
+    while response.status_code == 202:
+        if time.monotonic() > deadline:
+            print("Ingestion still running after", timeout, "seconds")
+            return None
+        time.sleep(poll_interval)
+        response = requests.request("GET", f"{url}/{job_id}", headers=headers)
+
     if response.status_code == 200:
         return {'data': 'Updated ok'}
-        
+
     else:
         print("Request failed:", response.status_code)
         return None